@@ -3,14 +3,16 @@
 
 import cv2
 import numpy as np
-from PIL import Image
 import trustmark
 
 class AutoCornerDetector:
     """Automatically detect corners of watermarked images for perspective correction"""
     
-    def __init__(self):
-        self.tm = trustmark.TrustMark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER)
+    def __init__(self, tm=None):
+        # Reuse the caller's TrustMark so the process holds a single copy of the weights
+        if tm is None:
+            tm = trustmark.get_shared_trustmark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER, components=('decoder',))
+        self.tm = tm
     
     def detect_and_decode(self, image_path):
         """Main function: detect corners and decode watermark automatically"""
@@ -60,14 +62,18 @@ class AutoCornerDetector:
                     # Apply perspective correction
                     corrected = self.correct_perspective(variant_image, corners)
                     
-                    # Try to decode watermark (multi-scale)
-                    for size in (1024, 1280, 768):
-                        corrected_resized = cv2.resize(corrected, (size, size), interpolation=cv2.INTER_CUBIC)
-                        result = self.decode_watermark(corrected_resized)
-                        if result['success']:
-                            result['method'] = f"{variant_name}:{method.__name__}:{size}"
-                            result['corners'] = corners.tolist()
-                            return result
+                    # Try to decode watermark, then four shifted and rescaled views of the warp (the plain view
+                    # is not read again) in one batched decoder pass unless the plain read is nowhere near decodable
+                    result = self.decode_watermark(corrected)
+                    if not result['success'] and result.get('hopeless'):
+                        print("    ❌ Corners found but the read is nowhere near decodable, skipping other views")
+                        continue
+                    if not result['success']:
+                        result = self.decode_watermark(corrected, tta=4, tta_start=1)
+                    if result['success']:
+                        result['method'] = f"{variant_name}:{method.__name__}"
+                        result['corners'] = corners.tolist()
+                        return result
                     print("    ❌ Corners found but no watermark decoded on this variant")
                 else:
                     print(f"    ❌ Could not find 4 corners")
@@ -302,33 +308,40 @@ class AutoCornerDetector:
         
         return corrected
     
-    def decode_watermark(self, corrected_image):
-        """Decode watermark from perspective-corrected image"""
+    def decode_watermark(self, corrected_image, tta=0, tta_start=0):
+        """Decode watermark from perspective-corrected image, tta and tta_start as for TrustMark.decode"""
+        return self.decode_watermarks([corrected_image], tta, tta_start)[0]
+    
+    def decode_watermarks(self, corrected_images, tta=0, tta_start=0):
+        """Decode watermarks from several perspective-corrected images in one batch"""
         try:
-            # Convert to PIL Image
-            rgb_image = cv2.cvtColor(corrected_image, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(rgb_image)
-            
-            # Decode watermark
-            secret_id, present, confidence = self.tm.decode(pil_image)
-            
-            if present:
-                return {
-                    'success': True,
-                    'watermark_id': secret_id,
-                    'confidence': confidence
-                }
+            # Decode watermarks, TrustMark takes the BGR arrays as they are
+            if tta:
+                decodes = [self.tm.decode_detailed(image, tta=tta, tta_start=tta_start) for image in corrected_images]
             else:
-                return {
-                    'success': False,
-                    'error': 'No watermark detected'
-                }
+                decodes = self.tm.decode_batch_detailed(corrected_images)
+            results = []
+            for decoded in decodes:
+                if decoded['detected']:
+                    results.append({
+                        'success': True,
+                        'watermark_id': decoded['secret'],
+                        'confidence': decoded['confidence'],
+                        'bitflips': decoded['bitflips']
+                    })
+                else:
+                    results.append({
+                        'success': False,
+                        'error': 'No watermark detected',
+                        'hopeless': decoded['hopeless']
+                    })
+            return results
                 
         except Exception as e:
-            return {
+            return [{
                 'success': False,
                 'error': f'Decoding error: {str(e)}'
-            }
+            } for _ in corrected_images]
     
     def visualize_detection(self, image_path, output_path=None):
         """Visualize the corner detection process (for debugging)"""
@@ -52,6 +52,9 @@ app.config.update(
     JSON_SORT_KEYS=False
 )
 
+# gunicorn worker processes, each gets an equal share of the host cores for inference
+WORKERS = int(os.getenv('WEB_CONCURRENCY', 2))
+
 # Initialize components
 detector = None
 tm = None
@@ -61,21 +64,23 @@ def initialize_components():
     global detector, tm
     
     try:
-        if AutoCornerDetector:
-            detector = AutoCornerDetector()
-            logger.info("AutoCornerDetector initialized successfully")
-        else:
-            logger.error("AutoCornerDetector not available")
-            
         if trustmark:
-            tm = trustmark.TrustMark(
+            tm = trustmark.get_shared_trustmark(
                 verbose=False, 
-                encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER
+                encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER,
+                components=('encoder', 'decoder'),
+                cpu_threads=trustmark.cpu_thread_budget(WORKERS)
             )
             logger.info("TrustMark initialized successfully")
         else:
             logger.error("TrustMark not available")
             
+        if AutoCornerDetector:
+            detector = AutoCornerDetector(tm)
+            logger.info("AutoCornerDetector initialized successfully")
+        else:
+            logger.error("AutoCornerDetector not available")
+            
     except Exception as e:
         logger.error(f"Failed to initialize components: {e}")
 
@@ -406,7 +411,7 @@ if __name__ == '__main__':
 
         options = {
             'bind': f'0.0.0.0:{port}',
-            'workers': 2,
+            'workers': WORKERS,
             'worker_class': 'sync',
             'timeout': 120,
             'keepalive': 2,
@@ -111,10 +111,10 @@ class AutoDetectionThread(QThread):
     detection_complete = pyqtSignal(dict)
     progress_update = pyqtSignal(str)
     
-    def __init__(self, image_path):
+    def __init__(self, image_path, tm=None):
         super().__init__()
         self.image_path = image_path
-        self.detector = AutoCornerDetector()
+        self.detector = AutoCornerDetector(tm)
     
     def run(self):
         """Run automatic detection in background"""
@@ -294,7 +294,7 @@ class EnhancedWatermarkApp(QMainWindow):
         
         # Initialize components
         self.db = self.load_database()
-        self.tm = trustmark.TrustMark(verbose=False, encoding_type=ENCODING_TYPE)
+        self.tm = trustmark.get_shared_trustmark(verbose=False, encoding_type=ENCODING_TYPE, components=('encoder', 'decoder'))
         self.detection_thread = None
         
         # Setup UI
@@ -414,7 +414,7 @@ class EnhancedWatermarkApp(QMainWindow):
         self.progress_bar.setRange(0, 0)  # Indeterminate progress
         
         # Start detection thread
-        self.detection_thread = AutoDetectionThread(self.selected_decode_image_path)
+        self.detection_thread = AutoDetectionThread(self.selected_decode_image_path, self.tm)
         self.detection_thread.detection_complete.connect(self.on_detection_complete)
         self.detection_thread.progress_update.connect(self.on_progress_update)
         self.detection_thread.start()
@@ -560,7 +560,8 @@ class EnhancedWatermarkApp(QMainWindow):
             image_to_decode = Image.fromarray(corrected_image_rgb)
 
             # Decode watermark
-            secret_id, present, confidence = self.tm.decode(image_to_decode)
+            decoded = self.tm.decode_detailed(image_to_decode)
+            secret_id, present, confidence = decoded['secret'], decoded['detected'], decoded['confidence']
 
             if not present:
                 self.decode_result_display.setText("FAILURE: No watermark was detected.")
@@ -576,7 +577,7 @@ class EnhancedWatermarkApp(QMainWindow):
                 
                 result_text = f"SUCCESS!\n\nID: {secret_id}\n"
                 result_text += f"Message: '{secret_message}'\n"
-                result_text += f"Confidence: {confidence}\n"
+                result_text += f"Confidence: {confidence:.3f}\n"
                 
                 if ipfs_cid:
                     result_text += f"IPFS CID: {ipfs_cid}\n"
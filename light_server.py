@@ -22,7 +22,7 @@ try:
     print("📦 Loading TrustMark (lightweight mode)...")
     import trustmark
     # Initialize with minimal memory footprint
-    tm = trustmark.TrustMark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER)
+    tm = trustmark.TrustMark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER, components=('encoder', 'decoder'))
     print("✅ TrustMark loaded successfully")
 except Exception as e:
     print(f"⚠️  TrustMark not available: {e}")
@@ -13,7 +13,7 @@ class AutoScanner:
     """Automated watermark scanning with computer vision"""
     
     def __init__(self):
-        self.tm = trustmark.TrustMark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER)
+        self.tm = trustmark.get_shared_trustmark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER, components=('decoder',))
         self.camera = None
         self.scanning = False
         self.last_scan_time = 0
@@ -52,17 +52,13 @@ class AutoScanner:
     def process_frame(self, frame):
         """Process a single camera frame for watermarks"""
         try:
-            # Convert to PIL Image
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(rgb_frame)
+            # Try to decode watermark directly (no corner selection needed), BGR frames go in as they are
+            decoded = self.tm.decode_detailed(frame)
             
-            # Try to decode watermark directly (no corner selection needed)
-            secret_id, present, confidence = self.tm.decode(pil_image)
-            
-            if present and confidence > 0.7:  # High confidence threshold
+            if decoded['detected'] and decoded['confidence'] > 0.7:  # High confidence threshold
                 return {
-                    'watermark_id': secret_id,
-                    'confidence': confidence,
+                    'watermark_id': decoded['secret'],
+                    'confidence': decoded['confidence'],
                     'timestamp': time.time()
                 }
                 
@@ -141,15 +137,15 @@ class AutoScanner:
     def scan_cropped_image(self, cropped_frame):
         """Scan a cropped/corrected image for watermarks"""
         try:
-            rgb_frame = cv2.cvtColor(cropped_frame, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(rgb_frame)
-            
-            secret_id, present, confidence = self.tm.decode(pil_image)
+            decoded = self.tm.decode_detailed(cropped_frame)
+            if not decoded['detected'] and not decoded['hopeless']:
+                # close to decodable, retry with four shifted and rescaled views (not the plain one again); hopeless crops are dropped here
+                decoded = self.tm.decode_detailed(cropped_frame, tta=4, tta_start=1)
             
-            if present and confidence > 0.5:  # Lower threshold for cropped images
+            if decoded['detected'] and decoded['confidence'] > 0.5:  # Lower threshold for cropped images
                 return {
-                    'watermark_id': secret_id,
-                    'confidence': confidence,
+                    'watermark_id': decoded['secret'],
+                    'confidence': decoded['confidence'],
                     'timestamp': time.time(),
                     'method': 'auto_crop'
                 }
@@ -170,7 +166,7 @@ class BatchScanner:
     """Scan multiple images in a directory automatically"""
     
     def __init__(self):
-        self.tm = trustmark.TrustMark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER)
+        self.tm = trustmark.get_shared_trustmark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER, components=('decoder',))
         self.results = []
     
     def scan_directory(self, directory_path, extensions=('.jpg', '.jpeg', '.png')):
@@ -195,13 +191,13 @@ class BatchScanner:
         """Scan a single image file"""
         try:
             image = Image.open(file_path).convert('RGB')
-            secret_id, present, confidence = self.tm.decode(image)
+            decoded = self.tm.decode_detailed(image)
             
-            if present:
+            if decoded['detected']:
                 return {
                     'file_path': file_path,
-                    'watermark_id': secret_id,
-                    'confidence': confidence,
+                    'watermark_id': decoded['secret'],
+                    'confidence': decoded['confidence'],
                     'timestamp': time.time()
                 }
                 
@@ -21,22 +21,22 @@ detector = None
 tm = None
 
 try:
-    print("📦 Loading auto corner detection...")
-    from auto_corner_detection import AutoCornerDetector
-    detector = AutoCornerDetector()
-    print("✅ AutoCornerDetector loaded successfully")
+    print("📦 Loading TrustMark...")
+    import trustmark
+    tm = trustmark.get_shared_trustmark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER, components=('encoder', 'decoder'))
+    print("✅ TrustMark loaded successfully")
 except Exception as e:
-    print(f"❌ AutoCornerDetector failed: {e}")
+    print(f"❌ TrustMark failed: {e}")
     import traceback
     traceback.print_exc()
 
 try:
-    print("📦 Loading TrustMark...")
-    import trustmark
-    tm = trustmark.TrustMark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER)
-    print("✅ TrustMark loaded successfully")
+    print("📦 Loading auto corner detection...")
+    from auto_corner_detection import AutoCornerDetector
+    detector = AutoCornerDetector(tm)
+    print("✅ AutoCornerDetector loaded successfully")
 except Exception as e:
-    print(f"❌ TrustMark failed: {e}")
+    print(f"❌ AutoCornerDetector failed: {e}")
     import traceback
     traceback.print_exc()
 
@@ -137,7 +137,6 @@ def scan_manual():
             # Load image with OpenCV
             import cv2
             import numpy as np
-            from PIL import Image as PILImage
             
             image = cv2.imread(temp_path)
             if image is None:
@@ -159,12 +158,8 @@ def scan_manual():
             matrix = cv2.getPerspectiveTransform(coordinates, destination_points)
             corrected_image_cv = cv2.warpPerspective(image, matrix, (output_width, output_height))
             
-            # Convert to RGB for TrustMark
-            corrected_image_rgb = cv2.cvtColor(corrected_image_cv, cv2.COLOR_BGR2RGB)
-            image_to_decode = PILImage.fromarray(corrected_image_rgb)
-            
-            # Decode watermark
-            secret_id, present, _ = tm.decode(image_to_decode)
+            # Decode watermark, TrustMark takes the BGR array as it is
+            secret_id, present, _ = tm.decode(corrected_image_cv)
             
             if present:
                 logger.info(f"✅ Manual scan successful: {secret_id}")
@@ -0,0 +1,62 @@
+import argparse
+import time
+import numpy as np
+from trustmark.bchecc import BCH, BCHFast
+from trustmark.datalayer import DataLayer, BCH_POLYNOMIAL
+
+def corrupted_codewords(bch, data_bits, count, rng):
+    """
+    Random codewords of the schema as (data, ecc) bytearrays, each with 0 to t+2
+    bit errors so that both corrections and failures are timed.
+    """
+    data_bytes = (data_bits + 7) // 8
+    ecc_bits = bch.get_ecc_bits()
+    codewords = []
+    for _ in range(count):
+        bits = np.zeros(data_bytes * 8, dtype=np.uint8)
+        bits[:data_bits] = rng.integers(0, 2, data_bits)
+        data = bytearray(np.packbits(bits).tobytes())
+        word = np.concatenate([bits, np.unpackbits(np.frombuffer(bytes(bch.encode(data)), dtype=np.uint8))[:ecc_bits]])
+        errors = rng.choice(np.r_[0:data_bits, data_bytes * 8:len(word)], rng.integers(0, bch.ECCstate.t + 3), replace=False)
+        word[errors] ^= 1
+        packed = np.packbits(word).tobytes()
+        codewords.append((packed[:data_bytes], packed[data_bytes:]))
+    return codewords
+
+def rate(bch, codewords, repeats):
+    """
+    Decodes per second over the codewords, best of repeats.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        for data, ecc in codewords:
+            bch.decode(bytearray(data), bytearray(ecc))
+        best = min(best, time.perf_counter() - tic)
+    return len(codewords) / best
+
+def main(args):
+    """
+    Compares single codeword decodes/sec of the reference BCH port against BCHFast
+    for each watermark schema, checking both give the same results.
+    """
+    print("Starting up...")
+    layer = DataLayer(100, verbose=False)
+    rng = np.random.default_rng(0)
+    print("\n--- RESULT ---")
+    for version in (0, 1, 2, 3):
+        t = layer.schemaCorrectable(version)
+        reference, fast = BCH(t, BCH_POLYNOMIAL), BCHFast(t, BCH_POLYNOMIAL)
+        codewords = corrupted_codewords(reference, layer.schemaCapacity(version), args.codewords, rng)
+        for data, ecc in codewords:
+            a, b = bytearray(data), bytearray(data)
+            assert reference.decode(a, bytearray(ecc)) == fast.decode(b, bytearray(ecc)) and a == b, "BCHFast disagrees with BCH"
+        before, after = rate(reference, codewords, args.repeats), rate(fast, codewords, args.repeats)
+        print(f"{layer.schemaInfo(version):9s} (t={t}): BCH {before:8.0f} decodes/s  BCHFast {after:8.0f} decodes/s  ({after / before:4.1f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the fast single codeword BCH decoder against the reference port.")
+    parser.add_argument("--codewords", type=int, default=2000, help="Corrupted codewords decoded per schema.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed passes over the codewords (best is reported).")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,58 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+def run_level(tm, args, images, concurrency):
+    """
+    Issues args.requests calls from `concurrency` threads sharing one TrustMark, as a
+    threaded server worker would, and returns per-request latencies and wall time.
+    """
+    if args.component == 'decoder':
+        call = lambda image: tm.decode(image)
+    else:
+        call = lambda image: tm.encode(image, "OK")
+
+    def timed(i):
+        tic = time.time()
+        call(images[i % len(images)])
+        return time.time() - tic
+
+    call(images[0])  # warm up
+    tic = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, range(args.requests)))
+    return np.array(latencies), time.time() - tic
+
+def main(args):
+    """
+    Measures latency and throughput of one worker at 1, 2 and 4 concurrent requests
+    under a given inference runtime configuration (thread budget, channels_last).
+    """
+    import trustmark
+    print("Starting up...")
+    threads = args.threads if args.threads else trustmark.cpu_thread_budget(args.workers)
+    tm = trustmark.TrustMark(verbose=False, model_type=args.model_type, components=(args.component,),
+                             cpu_threads=threads, channels_last=args.channels_last)
+    rng = np.random.default_rng(0)
+    images = [Image.fromarray(rng.integers(0, 256, (1024, 1024, 3), dtype=np.uint8)) for _ in range(4)]
+
+    print("\n--- RESULT ---")
+    print(f"Component: {args.component}  Threads per worker: {threads}  channels_last: {args.channels_last}")
+    for concurrency in args.concurrency:
+        latencies, wall = run_level(tm, args, images, concurrency)
+        print(f"{concurrency} concurrent: mean {latencies.mean() * 1000:8.1f} ms  p95 {np.percentile(latencies, 95) * 1000:8.1f} ms  "
+              f"throughput {args.requests / wall:6.2f} req/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark TrustMark latency under concurrent requests within one worker.")
+    parser.add_argument("--model_type", type=str, default="Q", choices=['C', 'Q', 'B', 'P'], help="TrustMark model variant.")
+    parser.add_argument("--component", type=str, default="decoder", choices=['decoder', 'encoder'], help="Network to benchmark.")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes sharing the host, sets the per-worker core budget.")
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads per worker (overrides --workers).")
+    parser.add_argument("--channels_last", action="store_true", help="Run the models in channels_last memory format.")
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[1, 2, 4], help="Concurrent request levels to measure.")
+    parser.add_argument("--requests", type=int, default=16, help="Requests issued per concurrency level.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,139 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+import numpy as np
+import trustmark.datalayer as datalayer
+from trustmark.bchecc import BCH
+from trustmark.datalayer import DataLayer, BCH_POLYNOMIAL, SCHEMAS
+
+def secrets(layer, version, MODE, count, rng):
+    """
+    Random secrets filling the data bits of the schema: upper case text, or bit strings.
+    """
+    capacity = layer.schemaCapacity(version)
+    if MODE == 'text':
+        return [''.join(chr(c) for c in rng.integers(65, 91, capacity // 7)) for _ in range(count)]
+    return [''.join('1' if b else '0' for b in rng.integers(0, 2, capacity)) for _ in range(count)]
+
+def corrupt(packets, bitflips, rng):
+    """
+    Copy of packets with exactly bitflips distinct bits flipped in each codeword (the version bits are kept).
+    """
+    packets = packets.copy()
+    for packet in packets:
+        flips = rng.choice(packets.shape[1] - 4, bitflips, replace=False)
+        packet[flips] = 1 - packet[flips]
+    return packets
+
+def best_rate(fn, count, repeats):
+    """
+    Items per second of fn() handling count items, best of repeats.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - tic)
+    return count / best
+
+def reference_ecc(bch, packets, data_bits):
+    """
+    ecc bits of each packet's data computed by BCH.encode, bool (N, ecc_bits).
+    """
+    ecc_bits = bch.get_ecc_bits()
+    out = []
+    for packet in packets:
+        data = bytearray(np.packbits(packet[:data_bits] != 0).tobytes())
+        out.append(np.unpackbits(np.frombuffer(bytes(bch.encode(data)), dtype=np.uint8))[:ecc_bits] == 1)
+    return np.array(out)
+
+def decoders(layer, reference, MODE):
+    """
+    The decode engines compared: name -> (decode(packets) -> results, batches or None if single packet).
+    """
+    def single(engine):
+        return lambda packets: [engine._decode_packet(p, MODE) for p in packets]
+
+    def batched(packets, batch):
+        minimum, datalayer.BATCH_DECODE_MIN = datalayer.BATCH_DECODE_MIN, 0  # always use BCHBatch
+        try:
+            bits = packets != 0
+            return [r for i in range(0, len(bits), batch) for r in layer.decode_packets(bits[i:i+batch], MODE)]
+        finally:
+            datalayer.BATCH_DECODE_MIN = minimum
+    return {'BCH': (single(reference), None), 'BCHFast': (single(layer), None), 'BCHBatch': (batched, True)}
+
+def main(args):
+    """
+    Measures encode and decode throughput of the ECC layer per schema, mode, number of
+    bit errors and batch size, checks every decode engine gives the same results, and
+    writes all measurements to a JSON file so runs can be compared.
+    """
+    print("Starting up...")
+    rng = np.random.default_rng(args.seed)
+    batches = [int(b) for b in args.batches.split(',')]
+    report = dict(meta=dict(python=platform.python_version(), numpy=np.__version__, platform=platform.platform(),
+                            processor=platform.processor(), date=datetime.now(timezone.utc).isoformat(), args=vars(args)),
+                  encode=[], decode=[])
+    mismatches = 0
+    for version in SCHEMAS:
+        layer = DataLayer(100, verbose=False, encoding_mode=version)
+        reference = DataLayer(100, verbose=False, encoding_mode=version)
+        reference.bch_decoders = {i: BCH(d.ECCstate.t, BCH_POLYNOMIAL) for i, d in layer.bch_decoders.items()}
+        t, name = layer.schemaCorrectable(version), layer.schemaInfo(version)
+        data_bits = layer.data_bitcount()
+        print(f"\n--- {name} (t={t}) ---")
+        for MODE in ('text', 'binary'):
+            encode = layer.encode_text if MODE == 'text' else layer.encode_binary
+            plain = secrets(layer, version, MODE, args.packets, rng)
+            packets = encode(plain)
+
+            # encode: the batch encoder against BCH.encode of every packet
+            parity = bool(np.array_equal(packets[:, data_bits:96] != 0, reference_ecc(reference.bch_decoders[5 if version == 0 else version], packets, data_bits)))
+            mismatches += not parity
+            for batch in batches:
+                rate = best_rate(lambda: [encode(plain[i:i+batch]) for i in range(0, len(plain), batch)], len(plain), args.repeats)
+                report['encode'].append(dict(schema=name, version=version, t=t, mode=MODE, batch=batch, packets_per_sec=rate, parity=parity))
+                print(f"encode {MODE:6s} batch {batch:4d}: {rate:9.0f} packets/s{'' if parity else '  PARITY MISMATCH'}")
+
+            # decode: every engine at every number of bit errors
+            for bitflips in range(t + 3):
+                received = corrupt(packets, bitflips, rng)
+                runs = []
+                for engine, (decode, batched) in decoders(layer, reference, MODE).items():
+                    for batch in (batches if batched else [1]):
+                        fn = (lambda: decode(received, batch)) if batched else (lambda: decode(received))
+                        results = fn()
+                        rate = best_rate(fn, len(received), args.repeats)
+                        runs.append((engine, batch, rate, results))
+                expected = runs[0][3]
+                recovered = sum(r[1] and r[0] == s for r, s in zip(expected, plain)) / len(plain)
+                miscorrected = sum(r[1] and r[0] != s for r, s in zip(expected, plain)) / len(plain)
+                line = []
+                for engine, batch, rate, results in runs:
+                    parity = results == expected
+                    mismatches += not parity
+                    report['decode'].append(dict(schema=name, version=version, t=t, mode=MODE, bitflips=bitflips, engine=engine, batch=batch,
+                                                 packets_per_sec=rate, recovered=recovered, miscorrected=miscorrected, parity=parity))
+                    line.append(f"{engine}{'/' + str(batch) if engine == 'BCHBatch' else ''} {rate:.0f}{'' if parity else ' MISMATCH'}")
+                print(f"decode {MODE:6s} {bitflips:2d} flips: recovered {recovered:5.1%} miscorrected {miscorrected:5.1%}  packets/s " + '  '.join(line))
+
+    report['mismatches'] = mismatches
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n--- RESULT ---\n{len(report['encode'])} encode and {len(report['decode'])} decode measurements written to {args.output}, {mismatches} parity mismatches")
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ECC encode/decode throughput and parity per watermark schema.")
+    parser.add_argument("--packets", type=int, default=256, help="Packets per schema, mode and number of bit errors.")
+    parser.add_argument("--batches", type=str, default="1,16,256", help="Comma separated batch sizes for the batch encoder and decoder.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed passes per measurement (best is reported).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated secrets and bit errors.")
+    parser.add_argument("--output", type=str, default="ecc_benchmark.json", help="Path of the JSON results.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,55 @@
+import argparse
+import time
+import numpy as np
+from PIL import Image
+from trustmark import TrustMark
+
+def make_covers(args):
+    """
+    Loads the cover image (or synthesises random covers) for the print run.
+    """
+    if args.input_image:
+        cover = Image.open(args.input_image).convert('RGB')
+        return [cover] * args.count
+    rng = np.random.default_rng(0)
+    return [Image.fromarray(rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)) for _ in range(args.count)]
+
+def main(args):
+    """
+    Compares watermarking throughput of a per-image TrustMark.encode loop
+    against TrustMark.encode_batch for a whole print run.
+    """
+    print("Starting up...")
+    tm = TrustMark(verbose=False, model_type='Q', encoding_type=TrustMark.Encoding.BCH_SUPER, components=('encoder',))
+
+    covers = make_covers(args)
+    secrets = [f"{i:05d}" for i in range(args.count)]
+
+    # Warm up both paths so one-off allocations are not timed
+    tm.encode(covers[0], secrets[0])
+    tm.encode_batch(covers[:2], secrets[:2], batch_size=args.batch_size)
+
+    tic = time.time()
+    for cover, secret in zip(covers, secrets):
+        tm.encode(cover, secret)
+    loop_time = time.time() - tic
+
+    tic = time.time()
+    tm.encode_batch(covers, secrets, batch_size=args.batch_size)
+    batch_time = time.time() - tic
+
+    print("\n--- RESULT ---")
+    print(f"Images: {args.count}  Batch size: {args.batch_size}")
+    print(f"encode loop : {args.count / loop_time:8.2f} images/sec ({loop_time:.2f}s)")
+    print(f"encode_batch: {args.count / batch_time:8.2f} images/sec ({batch_time:.2f}s)")
+    print(f"Speedup     : {loop_time / batch_time:.2f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark TrustMark.encode_batch against a per-image encode loop.")
+    parser.add_argument("--input_image", type=str, default=None, help="Cover image to watermark (random covers if omitted).")
+    parser.add_argument("--count", type=int, default=64, help="Number of cards in the print run.")
+    parser.add_argument("--batch_size", type=int, default=8, help="Encoder mini-batch size.")
+    parser.add_argument("--width", type=int, default=1024, help="Width of synthetic covers.")
+    parser.add_argument("--height", type=int, default=1024, help="Height of synthetic covers.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,60 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+def boot(args, use_frozen):
+    """
+    Times import plus TrustMark construction in a fresh interpreter, so the
+    measurement includes module imports and config instantiation.
+    """
+    code = (
+        "import time; tic=time.time(); from trustmark import TrustMark; "
+        f"TrustMark(verbose=False, model_type='{args.model_type}', components=('{args.component}',), use_frozen={use_frozen}); "
+        "print(time.time()-tic)"
+    )
+    times = []
+    for _ in range(args.boots):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+def latency(args, use_frozen):
+    """
+    Times one decode (or encode) call on an already constructed TrustMark.
+    """
+    from trustmark import TrustMark
+    tm = TrustMark(verbose=False, model_type=args.model_type, components=(args.component,), use_frozen=use_frozen)
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (1024, 1024, 3), dtype=np.uint8))
+    if args.component == 'decoder':
+        call = lambda: tm.decode(image)
+    else:
+        call = lambda: tm.encode(image, "OK")
+    call()  # warm up
+    tic = time.time()
+    for _ in range(args.iterations):
+        call()
+    return (time.time() - tic) / args.iterations
+
+def main(args):
+    """
+    Compares boot time and per-call latency of the config/checkpoint path against
+    the frozen TorchScript artifacts written by scripts/export_frozen.py.
+    """
+    print("\n--- RESULT ---")
+    print(f"Component: {args.component}  Model: {args.model_type}")
+    for label, use_frozen in (("checkpoint", False), ("frozen", True)):
+        print(f"{label:10s}: boot {boot(args, use_frozen):6.2f}s  latency {latency(args, use_frozen) * 1000:8.1f} ms/call")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark frozen TorchScript artifacts against the checkpoint load path.")
+    parser.add_argument("--model_type", type=str, default="Q", choices=['C', 'Q', 'B', 'P'], help="TrustMark model variant.")
+    parser.add_argument("--component", type=str, default="decoder", choices=['decoder', 'encoder'], help="Network to benchmark.")
+    parser.add_argument("--boots", type=int, default=3, help="Fresh-process boots to time (best is reported).")
+    parser.add_argument("--iterations", type=int, default=20, help="Timed calls per path.")
+    args = parser.parse_args()
+    main(args)
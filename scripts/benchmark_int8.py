@@ -0,0 +1,100 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import time
+import numpy as np
+import torch
+from PIL import Image
+
+def load_covers(args):
+    """
+    Cover images from --images, or smooth synthetic covers when no directory is given.
+    """
+    if args.images:
+        files = sorted(f for f in glob.glob(os.path.join(args.images, '*')) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+        return [Image.open(f).convert('RGB') for f in files[:args.count]]
+    from trustmark.quantization import synthetic_covers
+    covers = synthetic_covers(args.count, 512, torch.Generator().manual_seed(1))
+    return [Image.fromarray(((c.permute(1, 2, 0).numpy() + 1.0) * 127.5).astype(np.uint8)) for c in covers]
+
+def evaluate(tm, stegos, packets, payloads, iterations):
+    """
+    Decoder logits, raw bit accuracy against the embedded packets, BCH detection rate,
+    payload recovery rate and mean single-image decode latency.
+    """
+    logits = tm.decoder_logits(stegos)
+    bit_accuracy = ((logits > 0) == packets.astype(bool)).mean()
+    results = tm.decode_batch(stegos, MODE='binary')
+    detected = np.mean([r[1] for r in results])
+    recovered = np.mean([r[1] and r[0] == p for r, p in zip(results, payloads)])
+
+    tm.decode(stegos[0])  # warm up
+    tic = time.time()
+    for i in range(iterations):
+        tm.decode(stegos[i % len(stegos)])
+    return logits, bit_accuracy, detected, recovered, (time.time() - tic) / iterations
+
+def main(args):
+    """
+    Reports the accuracy and latency of the int8 quantized decoder against fp32,
+    on images watermarked by the fp32 encoder with random BCH_SUPER payloads, plus the
+    time to export the int8 artifact offline and to load it when serving.
+    """
+    from trustmark import TrustMark
+    print("Starting up...")
+    int8_options = dict(verbose=False, model_type=args.model_type, encoding_type=TrustMark.Encoding.BCH_SUPER,
+                        precision='int8', int8_components=tuple(args.int8_components), device='cpu')
+    export_seconds = None
+    exporter = TrustMark(components=(), use_frozen=False, **int8_options)
+    if args.export or not all(os.path.isfile(exporter.locations[part + '-frozen']) for part in args.int8_components):
+        tic = time.time()
+        exporter.export_frozen(tuple(args.int8_components))
+        export_seconds = time.time() - tic
+    del exporter
+    fp32 = TrustMark(verbose=False, model_type=args.model_type, encoding_type=TrustMark.Encoding.BCH_SUPER, components=('encoder', 'decoder'), device='cpu')
+    tic = time.time()
+    int8 = TrustMark(components=('decoder',), **int8_options)
+    init_seconds = time.time() - tic
+
+    rng = np.random.RandomState(0)
+    covers = load_covers(args)
+    payloads = [''.join(str(b) for b in rng.randint(0, 2, fp32.schemaCapacity())) for _ in covers]
+    packets = fp32.encode_secrets(payloads, MODE='binary')
+    encoder = int8 if 'encoder' in args.int8_components else fp32
+    stegos = encoder.encode_batch(covers, payloads, MODE='binary')
+
+    print("\n--- RESULT ---")
+    print(f"Model: {args.model_type}  Images: {len(covers)}  Engine: {torch.backends.quantized.engine}")
+    if export_seconds is not None:
+        print(f"int8 export (offline calibration): {export_seconds:.1f} s")
+    print(f"int8 decoder init from the artifact: {init_seconds:.2f} s")
+    report = dict(model_type=args.model_type, images=len(covers), engine=torch.backends.quantized.engine, platform=platform.platform(),
+                  threads=torch.get_num_threads(), int8_components=args.int8_components, export_seconds=export_seconds, init_seconds=init_seconds)
+    outputs = dict()
+    for label, tm in (("fp32", fp32), ("int8", int8)):
+        logits, bit_accuracy, detected, recovered, latency = evaluate(tm, stegos, packets, payloads, args.iterations)
+        outputs[label] = logits
+        report[label] = dict(bit_accuracy=float(bit_accuracy), detected=float(detected), recovered=float(recovered), latency_ms=latency * 1000)
+        print(f"{label}: bit accuracy {bit_accuracy * 100:6.2f}%  detected {detected * 100:6.2f}%  recovered {recovered * 100:6.2f}%  latency {latency * 1000:8.1f} ms/decode")
+    # how closely int8 follows fp32, meaningful even where the covers are far from the training data
+    report['bit_agreement'] = float(((outputs['fp32'] > 0) == (outputs['int8'] > 0)).mean())
+    report['logit_correlation'] = float(np.corrcoef(outputs['fp32'].ravel(), outputs['int8'].ravel())[0, 1])
+    print(f"int8 vs fp32: bit agreement {report['bit_agreement'] * 100:6.2f}%  logit correlation {report['logit_correlation']:.4f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved report to: {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the int8 quantized TrustMark decoder against fp32.")
+    parser.add_argument("--model_type", type=str, default="Q", choices=['C', 'Q', 'B', 'P'], help="TrustMark model variant.")
+    parser.add_argument("--images", type=str, default="", help="Directory of cover images (synthetic covers if omitted).")
+    parser.add_argument("--count", type=int, default=32, help="Number of cover images to watermark.")
+    parser.add_argument("--iterations", type=int, default=20, help="Timed decode calls per precision.")
+    parser.add_argument("--int8_components", type=str, nargs='+', default=['decoder'], choices=['decoder', 'encoder'], help="Models to quantize.")
+    parser.add_argument("--export", action="store_true", help="Re-export the int8 artifacts even if present.")
+    parser.add_argument("--output", type=str, default="", help="Optional path of a JSON report.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,92 @@
+import argparse
+import io
+import json
+import os
+from datetime import datetime, timezone
+import numpy as np
+from PIL import Image, ImageFilter, ImageEnhance
+from trustmark import TrustMark
+from trustmark.trustmark import bit_error_probabilities, fit_confidence_temperature, within_correctable
+
+def perturb(image, rng):
+    """
+    A randomly degraded copy of image, the kind of damage scans go through: JPEG,
+    downscaling, blur and brightness changes.
+    """
+    width, height = image.size
+    scale = rng.uniform(0.4, 1.0)
+    image = image.resize((max(32, int(width * scale)), max(32, int(height * scale))), Image.BILINEAR)
+    if rng.random() < 0.5:
+        image = image.filter(ImageFilter.GaussianBlur(rng.uniform(0.3, 1.5)))
+    image = ImageEnhance.Brightness(image).enhance(rng.uniform(0.7, 1.3))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=int(rng.integers(30, 96)))
+    return Image.open(buffer).convert('RGB')
+
+def reliability(tm, logits, bits, temperature, bins=10):
+    """
+    (expected calibration error, per bin table) of the read confidences under temperature,
+    a read counting as right when no more protected bits are wrong than the schema corrects.
+    """
+    protected = tm.ecc.payload_len - tm.ecc.versionbits
+    correctable = tm.ecc.schemaCorrectable(tm.enctyp)
+    confidence = np.array([within_correctable(bit_error_probabilities(row[:protected], temperature), correctable) for row in logits])
+    errors = ((logits[:, :protected] > 0) != (bits[:, :protected] > 0.5)).sum(axis=1)
+    right = errors <= correctable
+    which = np.minimum((confidence * bins).astype(int), bins - 1)
+    table, ece = [], 0.0
+    for b in range(bins):
+        inside = which == b
+        if inside.any():
+            table.append(dict(bin=b, reads=int(inside.sum()), confidence=float(confidence[inside].mean()), accuracy=float(right[inside].mean())))
+            ece += inside.mean() * abs(confidence[inside].mean() - right[inside].mean())
+    return float(ece), table
+
+def main(args):
+    """
+    Fits the confidence temperature of a TrustMark model on held-out decodes: random IDs
+    are embedded in the cover images, the results degraded several times each and decoded,
+    and the temperature is fitted on half of the reads and checked on the other half.
+    """
+    print("Starting up...")
+    tm = TrustMark(verbose=False, model_type=args.model_type, encoding_type=args.encoding, components=('encoder', 'decoder'))
+    rng = np.random.default_rng(args.seed)
+    paths = sorted(os.path.join(args.images, f) for f in os.listdir(args.images) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    assert paths, f"no images in {args.images}"
+    logits, bits = [], []
+    for n, path in enumerate(paths):
+        cover = Image.open(path).convert('RGB')
+        secret = ''.join(chr(c) for c in rng.integers(65, 91, tm.ecc.schemaCapacity(args.encoding) // 7))
+        stego = tm.encode(cover, secret)
+        reads = [perturb(stego, rng) for _ in range(args.reads)]
+        logits.append(tm.decoder_logits(reads))
+        bits.append(np.repeat(tm.encode_secrets([secret]), len(reads), axis=0))
+        print(f"{n + 1}/{len(paths)} {os.path.basename(path)}")
+    logits, bits = np.concatenate(logits), np.concatenate(bits)
+
+    # fit on the reads of half the images, report on the other half
+    split = len(paths) // 2 * args.reads
+    fit, held = slice(0, split or len(logits)), slice(split, len(logits))
+    temperature = fit_confidence_temperature(logits[fit], bits[fit])
+    ece_before, _ = reliability(tm, logits[held], bits[held], 1.0)
+    ece_after, table = reliability(tm, logits[held], bits[held], temperature)
+    print(f"\n--- RESULT ---\ntemperature {temperature:.3f}: expected calibration error {ece_before:.3f} at 1.0, {ece_after:.3f} fitted ({held.stop - held.start} held-out reads)")
+    for row in table:
+        print(f"  confidence {row['confidence']:.2f}  decodable {row['accuracy']:.2f}  ({row['reads']} reads)")
+    output = args.output or tm.locations['calibration']
+    with open(output, 'w') as f:
+        json.dump(dict(temperature=temperature, model_type=args.model_type, encoding=args.encoding, images=len(paths),
+                       reads=len(logits), held_out_reads=held.stop - held.start, ece_uncalibrated=ece_before, ece=ece_after,
+                       reliability=table, date=datetime.now(timezone.utc).isoformat()), f, indent=2)
+    print(f"Saved calibration to: {output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the TrustMark confidence temperature on held-out decodes.")
+    parser.add_argument("--images", type=str, required=True, help="Folder of held-out cover images (not used in training).")
+    parser.add_argument("--model_type", type=str, default="Q", help="TrustMark model type to calibrate.")
+    parser.add_argument("--encoding", type=int, default=TrustMark.Encoding.BCH_SUPER, help="Encoding schema of the embedded IDs.")
+    parser.add_argument("--reads", type=int, default=8, help="Degraded copies decoded per image.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the IDs and degradations.")
+    parser.add_argument("--output", type=str, default="", help="Path of the calibration json, by default next to the model checkpoints where TrustMark reads it.")
+    args = parser.parse_args()
+    main(args)
@@ -1,7 +1,7 @@
 from trustmark import TrustMark
 
 # Initialize with the same settings we've been using
-tm = TrustMark(verbose=False, model_type='Q', encoding_type=TrustMark.Encoding.BCH_SUPER)
+tm = TrustMark(verbose=False, model_type='Q', encoding_type=TrustMark.Encoding.BCH_SUPER, components=())
 
 # Get the capacity in bits
 bit_capacity = tm.schemaCapacity()
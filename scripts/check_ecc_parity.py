@@ -0,0 +1,165 @@
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import numpy as np
+import trustmark.datalayer as datalayer
+from trustmark import bchecc
+from trustmark.bchecc import BCH, BCHFast
+from trustmark.datalayer import DataLayer, BCH_POLYNOMIAL, SCHEMAS
+
+# MD5 of the exponents, logarithms, elp_pre and cyclic_tab tables and ecc_bits of each code,
+# as generated by the original bchecc.py
+TABLE_MD5 = {8: 'dadeab7cae8c5a63b62982e9be810b5a', 5: '04e519d0b3c9ea429e3623d2de212fcc',
+             4: 'e30e8bc94281cb826063c847982ebeec', 3: '2949cdf227bbf12ef34bbf1cf4e87e05'}
+
+class ReferenceLayer(object):
+    """
+    The original string based packet encoder and decoder of DataLayer, on the reference
+    BCH engine, kept as the ground truth the optimised paths are checked against.
+    """
+    def __init__(self, version):
+        self.version = version
+        self.bch = {v: BCH(t, BCH_POLYNOMIAL) for v, t in ((0, 8), (1, 5), (2, 4), (3, 3))}
+        self.capacity = {0: 40, 1: 61, 2: 68, 3: 75}
+
+    def encode(self, secret, MODE):
+        if MODE == 'text':
+            bits = ''.join(format(ord(c) & 127, '07b') for c in secret)
+            bits = bits + '0' * (-len(bits) % 8)
+        else:
+            bits = secret
+        bch = self.bch[self.version]
+        data_bits = 96 - bch.get_ecc_bits()
+        bits = bits[:data_bits].ljust(data_bits, '0')
+        data = bit_bytes(bits)
+        ecc = ''.join(format(x, '08b') for x in bch.encode(data))[:bch.get_ecc_bits()]
+        return np.array([int(b) for b in bits + ecc + format(self.version, '04b')], dtype=np.float32)
+
+    def decode(self, packet, MODE):
+        packet = ''.join(str(int(bit)) for bit in packet)
+        version = int(packet[-2:], 2)
+        bch, capacity = self.bch[version], self.capacity[version]
+        data, ecc = bit_bytes(packet[:capacity]), bit_bytes(packet[capacity:96])
+        text0 = ascii7_text(bytes(data))
+        bitflips = bch.decode(data, ecc) if len(ecc) == bch.get_ecc_bytes() else -1
+        detected = bitflips != -1
+        if MODE == 'text':
+            secret = ascii7_text(bytes(data)) if detected else text0
+        else:
+            secret = ''.join(format(x, '08b') for x in data)[:capacity]
+        return secret, detected, version, bitflips
+
+def bit_bytes(bits):
+    # bytearray of a bit string, zero padded to whole bytes
+    bits = bits + '0' * (-len(bits) % 8)
+    return bytearray(int(bits[i:i+8], 2) for i in range(0, len(bits), 8))
+
+def ascii7_text(data):
+    bits = ''.join(format(x, '08b') for x in data)
+    return bytes(int(bits[i:i+7], 2) for i in range(0, len(bits), 7)).decode('utf-8').rstrip('\x00').strip()
+
+def table_md5(tables):
+    # fingerprint of the tables of one code, a dict as kept in bchecc.BCH_TABLES
+    h = hashlib.md5()
+    for name in bchecc.BCH_TABLE_NAMES:
+        h.update(np.array(tables[name], dtype=np.uint32).tobytes())
+    h.update(np.array([tables['ecc_bits']], dtype=np.uint32).tobytes())
+    return h.hexdigest()
+
+def packets(layer, reference, MODE, count, rng):
+    """
+    Encoded random secrets of the schema with 0 to t+3 bit errors in the data and ecc bits,
+    plus pure noise packets, as (secrets, packets float32 (N, 100)).
+    """
+    capacity, t = layer.schemaCapacity(layer.encoding_mode), layer.schemaCorrectable(layer.encoding_mode)
+    if MODE == 'text':
+        secrets = [''.join(chr(c) for c in rng.integers(32, 127, rng.integers(0, capacity // 7 + 1))) for _ in range(count)]
+    else:
+        secrets = [''.join('1' if b else '0' for b in rng.integers(0, 2, capacity)) for _ in range(count)]
+    clean = np.stack([reference.encode(s, MODE) for s in secrets])
+    corrupt = clean.copy()
+    for packet in corrupt:
+        flips = rng.choice(96, rng.integers(0, t + 4), replace=False)
+        packet[flips] = 1 - packet[flips]
+    noise = rng.integers(0, 2, (count // 4, 100)).astype(np.float32)
+    return secrets, clean, np.concatenate([clean, corrupt, noise])
+
+def check(name, got, expected):
+    wrong = sum(g != e for g, e in zip(got, expected)) + abs(len(got) - len(expected))
+    print(f"{name:44s} {'ok' if not wrong else 'FAILED: %d of %d differ' % (wrong, len(expected))}")
+    return wrong == 0
+
+def main(args):
+    """
+    Checks the optimised ECC paths against the original string based DataLayer code on the
+    reference BCH engine, for every schema: the BCH tables, the batch encoder, the single
+    codeword (BCHFast), batch (BCHBatch) and cached decoders, on clean, correctable,
+    uncorrectable and noise packets. Exits non-zero on any difference.
+    """
+    print("Starting up...")
+    bchecc.BCH_TABLES_FILE = None  # generate the tables here rather than load them
+    rng = np.random.default_rng(args.seed)
+    ok = True
+    for version in SCHEMAS:
+        reference = ReferenceLayer(version)
+        layer = DataLayer(100, verbose=False, encoding_mode=version)
+        t = layer.schemaCorrectable(version)
+        print(f"\n--- {layer.schemaInfo(version)} (t={t}) ---")
+        state = layer.schemaDecoder(version).ECCstate
+        tables = {name: getattr(state, name) for name in bchecc.BCH_TABLE_NAMES + ('ecc_bits',)}
+        ok &= check('BCH tables', [table_md5(tables)], [TABLE_MD5[t]])
+
+        # raw codewords: BCHFast against BCH, corrected data and bitflips
+        fast, bch = BCHFast(t, BCH_POLYNOMIAL), reference.bch[version]
+        data_bytes = (layer.schemaCapacity(version) + 7) // 8
+        expected, got = [], []
+        for _ in range(args.packets):
+            data = bytearray(rng.integers(0, 256, data_bytes).astype(np.uint8).tobytes())
+            bits = np.unpackbits(np.frombuffer(bytes(data + bch.encode(data)), dtype=np.uint8))
+            bits[rng.choice(len(bits), rng.integers(0, t + 4), replace=False)] ^= 1
+            packed = np.packbits(bits).tobytes()
+            for engine, out in ((bch, expected), (fast, got)):
+                d, e = bytearray(packed[:data_bytes]), bytearray(packed[data_bytes:])
+                out.append((engine.decode(d, e), bytes(d), bytes(engine.encode(bytearray(packed[:data_bytes])))))
+        ok &= check('BCHFast codewords', got, expected)
+
+        for MODE in ('text', 'binary'):
+            secrets, clean, received = packets(layer, reference, MODE, args.packets, rng)
+            encode = layer.encode_text if MODE == 'text' else layer.encode_binary
+            ok &= check(f'{MODE} encode', [p.tobytes() for p in encode(secrets)], [p.tobytes() for p in clean])
+            expected = [reference.decode(p, MODE) for p in received]
+            ok &= check(f'{MODE} decode, single codeword', [layer._decode_packet(p, MODE) for p in received], expected)
+            minimum, datalayer.BATCH_DECODE_MIN = datalayer.BATCH_DECODE_MIN, 0  # always use BCHBatch
+            try:
+                ok &= check(f'{MODE} decode, batch', layer.decode_packets(received != 0, MODE), expected)
+            finally:
+                datalayer.BATCH_DECODE_MIN = minimum
+            datalayer.clear_decode_cache()
+            ok &= check(f'{MODE} decode, cold cache', layer.decode_bitstream_detail(received, MODE), expected)
+            ok &= check(f'{MODE} decode, warm cache', layer.decode_bitstream_detail(received[::-1], MODE), expected[::-1])
+            ok &= check(f'{MODE} decode_bitstream', layer.decode_bitstream(received, MODE), [e[:3] for e in expected])
+
+    # the tables file written by save_bch_tables has to give the same tables back
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bch_tables.npz')
+        bchecc.save_bch_tables(path)
+        built = dict(bchecc.BCH_TABLES)
+        bchecc.BCH_TABLES.clear()
+        bchecc.load_bch_tables(path)
+        loaded = dict(bchecc.BCH_TABLES)
+        bchecc.BCH_TABLES.update(built)
+    print()
+    ok &= check('tables file round trip', [table_md5(loaded[key]) if key in loaded else None for key in built],
+                [TABLE_MD5[t] for t, poly in built])
+    print(f"\n--- RESULT ---\n{'all ECC paths match the reference' if ok else 'ECC paths DIFFER from the reference'}")
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the optimised ECC encoders and decoders against the reference BCH code.")
+    parser.add_argument("--packets", type=int, default=200, help="Secrets per schema and mode (each also sent corrupted), and codewords per schema.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated secrets and bit errors.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+from PIL import Image
+from trustmark.merge import open_strips
+
+def sample_images(width, height, rng):
+    """
+    The test inputs as (file name, PIL image, save options), covering the modes and
+    compressions open_strips has to convert or fall back on.
+    """
+    rgb = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    rgba = Image.fromarray(rng.integers(0, 256, (height, width, 4), dtype=np.uint8))
+    grey = Image.fromarray(rng.integers(0, 256, (height, width), dtype=np.uint8))
+    palette = rgb.quantize(16)
+    palette.info['transparency'] = 3
+    return [
+        ('rgb.tif', rgb, {}),
+        ('rgb_lzw.tif', rgb, dict(compression='tiff_lzw')),
+        ('rgb_deflate.tif', rgb, dict(compression='tiff_adobe_deflate')),
+        ('grey.tif', grey, {}),
+        ('grey_lzw.tif', grey, dict(compression='tiff_lzw')),
+        ('rgba.tif', rgba, {}),
+        ('rgb.png', rgb, {}),
+        ('rgba.png', rgba, {}),
+        ('grey.png', grey, {}),
+        ('palette.png', palette, {}),
+        ('palette_transparent.png', palette, dict(transparency=3)),
+        ('rgb.jpg', rgb, dict(quality=95)),
+    ]
+
+def main(args):
+    """
+    Writes images in every format open_strips reads, reads them back strip by strip and
+    checks the strips match PIL's convert('RGB') of the same file.
+    """
+    print("Starting up...")
+    rng = np.random.default_rng(0)
+    failures = 0
+    with tempfile.TemporaryDirectory() as folder:
+        images = sample_images(args.width, args.height, rng)
+        for name, image, options in images:
+            path = os.path.join(folder, name)
+            image.save(path, **options)
+            expected = np.asarray(Image.open(path).convert('RGB'))
+            try:
+                width, height, strips = open_strips(path)
+                got = np.concatenate(list(strips(args.rows)))
+                ok = (width, height) == (args.width, args.height) and got.dtype == np.uint8 and np.array_equal(got, expected)
+            except Exception as e:
+                got, ok = e, False
+            failures += not ok
+            print(f"{name:24s} {'ok' if ok else 'FAILED: %s' % (got if isinstance(got, Exception) else 'strips differ from PIL')}")
+        grey = rng.integers(0, 256, (args.height, args.width), dtype=np.uint8)
+        path = os.path.join(folder, 'grey.npy')
+        np.save(path, grey)
+        got = np.concatenate(list(open_strips(path)[2](args.rows)))
+        ok = np.array_equal(got, np.repeat(grey[:, :, None], 3, axis=2))
+        failures += not ok
+        print(f"{'grey.npy':24s} {'ok' if ok else 'FAILED'}")
+    print(f"\n--- RESULT ---\n{failures} of {len(images) + 1} formats failed")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check open_strips reads every supported image format as RGB strips.")
+    parser.add_argument("--width", type=int, default=97, help="Width of the test images.")
+    parser.add_argument("--height", type=int, default=61, help="Height of the test images.")
+    parser.add_argument("--rows", type=int, default=16, help="Rows per strip.")
+    args = parser.parse_args()
+    main(args)
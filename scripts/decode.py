@@ -9,7 +9,7 @@ def main(args):
     # --- 1. Initialize TrustMark ---
     # Must use the same settings as the encoder
     print("Starting up...")
-    tm = TrustMark(verbose=False, model_type='Q', encoding_type=TrustMark.Encoding.BCH_SUPER)
+    tm = TrustMark(verbose=False, model_type='Q', encoding_type=TrustMark.Encoding.BCH_SUPER, components=('decoder',), reverify=args.reverify)
 
     # --- 2. Load Image ---
     print(f"Loading image for decoding: {args.image_to_decode}")
@@ -34,5 +34,6 @@ def main(args):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Decode a TrustMark watermark from an image.")
     parser.add_argument("image_to_decode", type=str, help="Path to the watermarked image to decode.")
+    parser.add_argument("--reverify", action="store_true", help="Recompute model checksums instead of trusting the .verified stamps.")
     args = parser.parse_args()
     main(args) 
\ No newline at end of file
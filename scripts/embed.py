@@ -11,7 +11,7 @@ def main(args):
     # We use schema 0 for the strongest ECC (BCH_SUPER)
     # We use model_type 'Q' for quality, as recommended for photos
     print("Starting up...")
-    tm = TrustMark(verbose=False, model_type='Q', encoding_type=TrustMark.Encoding.BCH_SUPER)
+    tm = TrustMark(verbose=False, model_type='Q', encoding_type=TrustMark.Encoding.BCH_SUPER, components=('encoder', 'decoder'), reverify=args.reverify)
 
     # --- 2. Load Image ---
     print(f"Loading image: {args.input_image}")
@@ -24,7 +24,13 @@ def main(args):
     # --- 3. Embed Watermark ---
     message = "OK"
     print(f"Embedding message: '{message}'")
-    watermarked_image = tm.encode(cover_image, message)
+    if args.preview_image:
+        # full size and preview renditions from a single encoder pass
+        watermarked_image, preview_image = tm.encode(cover_image, message, renditions=[None, args.preview_long_edge])
+        preview_image.save(args.preview_image)
+        print(f"Saved {preview_image.size[0]}x{preview_image.size[1]} preview to: {args.preview_image}")
+    else:
+        watermarked_image = tm.encode(cover_image, message)
     watermarked_image.save(args.output_image)
     print(f"Saved watermarked image to: {args.output_image}")
 
@@ -49,5 +55,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Embed and verify a TrustMark watermark.")
     parser.add_argument("--input_image", type=str, default="/Users/parallel/encoded/doom.jpg", help="Path to the input image.")
     parser.add_argument("--output_image", type=str, default="doom_watermarked.png", help="Path to save the watermarked image.")
+    parser.add_argument("--preview_image", type=str, default="", help="Optional path for a watermarked preview rendition.")
+    parser.add_argument("--preview_long_edge", type=int, default=1024, help="Long edge of the preview rendition in pixels.")
+    parser.add_argument("--reverify", action="store_true", help="Recompute model checksums instead of trusting the .verified stamps.")
     args = parser.parse_args()
     main(args) 
\ No newline at end of file
@@ -0,0 +1,19 @@
+import argparse
+from trustmark import bchecc
+from trustmark.datalayer import DataLayer
+
+def main(args):
+    """
+    Builds the BCH tables of every watermark schema and writes them to one file,
+    which later processes load instead of regenerating the tables.
+    """
+    print("Starting up...")
+    DataLayer(100, verbose=False)  # builds the code of every schema
+    bchecc.save_bch_tables(args.output)
+    print(f"Wrote tables of {len(bchecc.BCH_TABLES)} BCH codes to: {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export precomputed BCH tables for fast DataLayer construction.")
+    parser.add_argument("--output", type=str, default=bchecc.BCH_TABLES_FILE, help="File to write, read by default when present.")
+    args = parser.parse_args()
+    main(args)
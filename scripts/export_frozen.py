@@ -0,0 +1,27 @@
+import argparse
+from trustmark import TrustMark
+
+def main(args):
+    """
+    Exports frozen TorchScript artifacts for the TrustMark networks, which later
+    TrustMark instances load directly instead of the yaml config and checkpoint.
+    With --precision int8 the int8_components are quantized and calibrated here,
+    so serving instances only load the int8 artifact.
+    """
+    print("Starting up...")
+    tm = TrustMark(verbose=False, model_type=args.model_type, device=args.device, components=(), use_frozen=False,
+                   precision=args.precision, int8_components=tuple(args.int8_components.split(',')))
+
+    components = tuple(args.components.split(','))
+    for path in tm.export_frozen(components):
+        print(f"Wrote frozen artifact: {path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export frozen TorchScript artifacts for fast TrustMark boot.")
+    parser.add_argument("--model_type", type=str, default="Q", choices=['C', 'Q', 'B', 'P'], help="TrustMark model variant.")
+    parser.add_argument("--device", type=str, default="", help="Device the artifacts will be served on (default: cuda if available, else cpu).")
+    parser.add_argument("--components", type=str, default="decoder,encoder,remover", help="Comma separated networks to export.")
+    parser.add_argument("--precision", type=str, default="fp32", choices=['fp32', 'int8'], help="int8 quantizes --int8_components (cpu only).")
+    parser.add_argument("--int8_components", type=str, default="decoder", help="Comma separated networks quantized with --precision int8.")
+    args = parser.parse_args()
+    main(args)
@@ -73,7 +73,7 @@ def main(args):
 
     # --- Decode Watermark ---
     print("\nStarting up...")
-    tm = TrustMark(verbose=False, model_type='Q', encoding_type=TrustMark.Encoding.BCH_SUPER)
+    tm = TrustMark(verbose=False, model_type='Q', encoding_type=TrustMark.Encoding.BCH_SUPER, components=('decoder',))
     
     print("Attempting to decode watermark from corrected image...")
     secret, present, _ = tm.decode(corrected_image_pil)
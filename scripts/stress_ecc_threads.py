@@ -0,0 +1,115 @@
+import argparse
+import sys
+import threading
+import numpy as np
+import trustmark.datalayer as datalayer
+from trustmark.bchecc import BCH
+from trustmark.datalayer import DataLayer, BCH_POLYNOMIAL
+
+def corrupted_packets(layer, count, rng):
+    """
+    Random BCH_SUPER text packets with 0 to t+2 bit errors, plus some pure noise,
+    as float32 (count, 100).
+    """
+    texts = [''.join(chr(c) for c in rng.integers(48, 91, 5)) for _ in range(count)]
+    packets = layer.encode_text(texts)
+    for packet in packets:
+        flips = rng.choice(96, rng.integers(0, 11), replace=False)
+        packet[flips] = 1 - packet[flips]
+    noise = rng.random(count) < 0.1
+    packets[noise] = rng.integers(0, 2, (noise.sum(), 100))
+    return packets
+
+def codewords(bch, data_bytes, count, rng):
+    """
+    Random (data, ecc) codewords of bch with 0 to t+2 bit errors.
+    """
+    words = []
+    for _ in range(count):
+        data = bytearray(rng.integers(0, 256, data_bytes).astype(np.uint8).tobytes())
+        bits = np.unpackbits(np.frombuffer(bytes(data + bch.encode(data)), dtype=np.uint8))
+        bits[rng.choice(data_bytes * 8 + bch.get_ecc_bits(), rng.integers(0, bch.ECCstate.t + 3), replace=False)] ^= 1
+        packed = np.packbits(bits).tobytes()
+        words.append((packed[:data_bytes], packed[data_bytes:]))
+    return words
+
+def bch_results(bch, words):
+    results = []
+    for data, ecc in words:
+        data, ecc = bytearray(data), bytearray(ecc)
+        results.append((bch.decode(data, ecc), bytes(data), bytes(bch.encode(data))))
+    return results
+
+def run_threads(threads, work):
+    """
+    Runs work(index) in threads at once, returns the number of threads that saw a wrong result.
+    """
+    failures = []
+    start = threading.Barrier(threads)
+
+    def worker(index):
+        start.wait()
+        if not work(index):
+            failures.append(index)
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return len(failures)
+
+def main(args):
+    """
+    Decodes packets from many threads sharing one DataLayer, and codewords from threads
+    sharing one reference BCH, checking every result against a single threaded run.
+    """
+    print("Starting up...")
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible to provoke interleaving
+    if args.no_cache:
+        datalayer.DECODE_CACHE_SIZE = 0  # every decode runs the BCH code
+    rng = np.random.default_rng(args.seed)
+    layer = DataLayer(100, verbose=False)
+    packets = corrupted_packets(layer, args.packets, rng)
+    expected = {MODE: [layer._decode_packet(p, MODE) for p in packets] for MODE in ('text', 'binary')}
+
+    def decode_work(index):
+        local = np.random.default_rng(index)
+        for _ in range(args.iterations):
+            rows = local.integers(0, len(packets), local.integers(1, args.batch + 1))
+            MODE = ('text', 'binary')[index % 2]
+            results = layer.decode_bitstream_detail(packets[rows], MODE)
+            if results != [expected[MODE][r] for r in rows]:
+                return False
+        return True
+
+    bch = BCH(8, BCH_POLYNOMIAL)
+    words = codewords(bch, 5, args.packets, rng)
+    reference = bch_results(bch, words)
+
+    def bch_work(index):
+        local = np.random.default_rng(index)
+        for _ in range(args.iterations):
+            rows = local.integers(0, len(words), 8)
+            if bch_results(bch, [words[r] for r in rows]) != [reference[r] for r in rows]:
+                return False
+        return True
+
+    print("\n--- RESULT ---")
+    failed = run_threads(args.threads, decode_work)
+    print(f"DataLayer: {args.threads} threads x {args.iterations} decodes, {failed} threads saw wrong results")
+    failed_bch = run_threads(args.threads, bch_work)
+    print(f"BCH:       {args.threads} threads x {args.iterations} decodes, {failed_bch} threads saw wrong results")
+    print("decode cache:", datalayer.decode_cache_info())
+    if failed or failed_bch:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress the ECC layer with concurrent decode threads.")
+    parser.add_argument("--threads", type=int, default=16, help="Concurrent decode threads.")
+    parser.add_argument("--iterations", type=int, default=200, help="Decode calls per thread.")
+    parser.add_argument("--packets", type=int, default=500, help="Distinct corrupted packets to draw from.")
+    parser.add_argument("--batch", type=int, default=8, help="Most packets per DataLayer decode call.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated packets.")
+    parser.add_argument("--no_cache", action="store_true", help="Disable the decode result cache so every call runs the BCH code.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,35 @@
+import argparse
+import os
+import pathlib
+import time
+import trustmark
+from trustmark.trustmark import MODEL_CHECKSUMS, verify_model_file
+
+def main(args):
+    """
+    Verifies the TrustMark model files for one variant against their checksums and
+    writes the .verified stamps that let later starts skip rehashing them.
+    """
+    models_dir = os.path.join(pathlib.Path(trustmark.__file__).parent.resolve(), 'models')
+    names = [name for name in MODEL_CHECKSUMS if pathlib.Path(name).stem.endswith(f'_{args.model_type}')]
+
+    failures = 0
+    for name in sorted(names):
+        filename = os.path.join(models_dir, name)
+        if not os.path.isfile(filename):
+            print(f"MISSING  {name}")
+            continue
+        tic = time.time()
+        valid = verify_model_file(filename, reverify=args.reverify)
+        print(f"{'OK      ' if valid else 'CORRUPT '} {name} ({time.time() - tic:.3f}s)")
+        failures += not valid
+
+    if failures:
+        print(f"\n{failures} model file(s) failed verification; they will be fetched again on next start.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify TrustMark model files and refresh their .verified stamps.")
+    parser.add_argument("--model_type", type=str, default="Q", choices=['C', 'Q', 'B', 'P'], help="TrustMark model variant.")
+    parser.add_argument("--reverify", action="store_true", help="Recompute the MD5 of every file, ignoring existing stamps.")
+    args = parser.parse_args()
+    main(args)
@@ -4,4 +4,4 @@ from __future__ import print_function
 
 import numpy as np
 
-from .trustmark import TrustMark
+from .trustmark import TrustMark, get_shared_trustmark, cpu_thread_budget
@@ -0,0 +1,192 @@
+# Copyright 2023 Adobe
+# All Rights Reserved.
+
+# NOTICE: Adobe permits you to use, modify, and distribute this file in
+# accordance with the terms of the Adobe license agreement accompanying
+# it.
+
+import numpy as np
+
+
+BATCH_ENGINES = dict()  # (t, poly, data_bytes) -> BCHBatch, shared by every DataLayer
+
+
+def batch_engine(bch, data_bytes):
+    # the shared BCHBatch of the code of bch with data_bytes of data, built on first use
+    key = (bch.ECCstate.t, bch.ECCstate.poly, data_bytes)
+    engine = BATCH_ENGINES.get(key)
+    if engine is None:
+        engine = BATCH_ENGINES.setdefault(key, BCHBatch(bch, data_bytes))
+    return engine
+
+
+class BCHBatch(object):
+    """ NumPy engine running a BCH code over a batch of codewords at once
+
+    Mirrors bchecc.BCH step for step (syndromes, Berlekamp-Massey, root search and the
+    corrections applied), so results match BCH.encode/decode exactly, quirks included.
+    A codeword is data_bytes*8 data bits, MSB first as BCH reads the bytes, followed by the
+    ecc bits, held as rows of a bool array; the GF(2^m) tables of the BCH instance are
+    reused as arrays.
+    """
+
+    def __init__(self, bch, data_bytes):
+        state = bch.ECCstate
+        self.n = n = state.n
+        self.m = m = state.m
+        self.t = t = state.t
+        self.ecc_bits = state.ecc_bits
+        self.data_bits = data_bytes * 8
+        self.nbits = nbits = self.data_bits + self.ecc_bits
+        self.width = 2 * t  # error locator coefficients, as BCH.decode allocates
+
+        self.log = np.array(state.logarithms, dtype=np.int64)
+        # exponents of any non negative power up to the largest the decoder forms, so that exp[v] is alpha^(v mod n)
+        self.exp = np.array(state.exponents[:n], dtype=np.int64)[np.arange((self.width + 2) * (n + 1)) % n]
+        self.elp_pre = np.array(state.elp_pre[:m], dtype=np.int64)
+
+        # syndrome S_j of a codeword is the XOR of alpha^(j*degree) over its set bits, the m bits of
+        # each power go in a column so the odd syndromes of a batch are one matrix product mod 2
+        degree = nbits - 1 - np.arange(nbits)
+        powers = self.exp[(np.arange(1, 2 * t, 2)[None, :] * degree[:, None]) % n]  # (nbits, t)
+        self.syndrome_bits = ((powers[:, :, None] >> np.arange(m)) & 1).reshape(nbits, t * m).astype(np.int32)
+
+        # encoding is linear, the ecc of a message is the XOR of the ecc of its set bits
+        parity = np.zeros((self.data_bits, self.ecc_bits), dtype=np.int32)
+        for i in range(self.data_bits):
+            unit = bytearray(data_bytes)
+            unit[i // 8] = 0x80 >> (i % 8)
+            ecc = np.unpackbits(np.frombuffer(bytes(bch.encode(unit)), dtype=np.uint8))
+            parity[i] = ecc[:self.ecc_bits]
+        self.parity = parity
+
+    def g_mul(self, a, b):
+        return np.where((a > 0) & (b > 0), self.exp[self.log[a] + self.log[b]], 0)
+
+    def g_sqr(self, a):
+        # BCH.g_sqrt, which squares
+        return np.where(a > 0, self.exp[2 * self.log[a]], 0)
+
+    def encode(self, data):
+        # Inputs: data bits, bool array (N, data_bits)
+        # Outputs: ecc bits, bool array (N, ecc_bits), as BCH.encode of the packed bytes
+        return (np.asarray(data, dtype=np.int32) @ self.parity) & 1 == 1
+
+    def syndromes(self, codewords):
+        # (N, 2t) syndromes S_1..S_2t of bool codewords (N, nbits)
+        N, t, m = codewords.shape[0], self.t, self.m
+        odd = (codewords.astype(np.int32) @ self.syndrome_bits) & 1
+        odd = (odd.reshape(N, t, m) << np.arange(m)).sum(axis=2)
+        syn = np.zeros((N, 2 * t), dtype=np.int64)
+        syn[:, 0::2] = odd
+        for i in range(t):
+            syn[:, 2 * i + 1] = self.g_sqr(syn[:, i])
+        return syn
+
+    def error_locators(self, syn):
+        # Berlekamp-Massey as BCH.decode, returns the coefficients (N, width) and degrees (N,)
+        N, n, t, W = syn.shape[0], self.n, self.t, self.width
+        elp = np.zeros((N, W), dtype=np.int64)
+        elp[:, 0] = 1
+        elp_deg = np.zeros(N, dtype=np.int64)
+        pelp, pelp_deg = elp.copy(), elp_deg.copy()
+        pp = np.full(N, -1, dtype=np.int64)
+        pd = np.ones(N, dtype=np.int64)
+        d = syn[:, 0].copy()
+        running = np.ones(N, dtype=bool)
+        cols = np.arange(W)
+        # syndrome index 2i+2-j of each coefficient j, python indexing of the original wraps negative ones
+        syn_index = [(2 * i + 2 - cols) % (2 * t) for i in range(t)]
+        for i in range(t):
+            running &= elp_deg <= t
+            update = running & (d > 0)
+            k = 2 * i - pp
+            elp_copy, copy_deg = elp.copy(), elp_deg.copy()
+            tmp = self.log[d] + n - self.log[pd]
+            # elp.c[j+k] ^= alpha^(tmp+log(pelp.c[j])) for the non zero pelp coefficients j <= pelp.deg
+            target = cols[None, :] + k[:, None]
+            hit = update[:, None] & (cols[None, :] <= pelp_deg[:, None]) & (pelp > 0) & (target < W)
+            r, j = np.nonzero(hit)
+            elp[r, target[r, j]] ^= self.exp[tmp[r] + self.log[pelp[r, j]]]
+            grow = update & (pelp_deg + k > elp_deg)
+            elp_deg = np.where(grow, pelp_deg + k, elp_deg)
+            pelp[grow], pelp_deg[grow] = elp_copy[grow], copy_deg[grow]
+            pd = np.where(grow, d, pd)
+            pp = np.where(grow, 2 * i, pp)
+            if i < t - 1:
+                terms = self.g_mul(elp, syn[:, syn_index[i]])
+                terms[(cols[None, :] == 0) | (cols[None, :] > elp_deg[:, None])] = 0
+                nd = syn[:, 2 * i + 2] ^ np.bitwise_xor.reduce(terms, axis=1)
+                d = np.where(running, nd, d)
+        return elp, elp_deg
+
+    def roots(self, elp, elp_deg):
+        # as BCH.getroots, returns bool (N, nbits+1) marking each root found, indexed by root value
+        # (the extra column collects any root beyond the codeword), and the root count (N,), -1 on failure
+        N, n, nbits = elp.shape[0], self.n, self.nbits
+        found = np.zeros((N, nbits + 1), dtype=np.int64)
+        nroots = np.zeros(N, dtype=np.int64)
+        log = self.log
+        c0, c1, c2 = elp[:, 0], elp[:, 1], elp[:, 2]
+
+        # degree 1
+        one = (elp_deg == 1) & (c0 > 0)
+        root = n - log[c0] + log[c1]
+        root = np.where(root < n, root, root - n)
+        found[one, np.minimum(root[one], nbits)] += 1
+        nroots[one] = 1
+
+        # degree 2
+        two = (elp_deg == 2) & (c0 > 0) & (c1 > 0)
+        l0, l1, l2 = log[c0], log[c1], log[c2]
+        u = self.exp[l0 + l2 + 2 * (n - l1)]
+        r = np.zeros(N, dtype=np.int64)
+        for i in range(self.m):
+            r ^= np.where((u >> i) & 1 == 1, self.elp_pre[i], 0)
+        two &= (self.g_sqr(r) ^ r) == u
+        for rr in (r, r ^ 1):
+            root = (2 * n - l1 - log[rr] + l2) % n
+            found[two, np.minimum(root[two], nbits)] += 1
+        nroots[two] = 2
+
+        # higher degrees, Chien search over the codeword positions
+        many = np.flatnonzero(elp_deg > 2)
+        if len(many):
+            poly, deg = elp[many], elp_deg[many]
+            cols = np.arange(poly.shape[1])[None, :]
+            lead = np.take_along_axis(poly, np.minimum(deg, poly.shape[1] - 1)[:, None], axis=1)[:, 0]
+            l = n - log[lead]
+            rep = log[poly] + l[:, None]
+            rep = np.where(rep < n, rep, rep - n)
+            rep = np.where(poly > 0, rep, -1)
+            rep = np.where(cols == deg[:, None], 0, rep)
+            use = (rep >= 0) & (cols >= 1) & (cols <= deg[:, None])
+            syn0 = np.where(poly[:, 0] > 0, self.exp[(log[poly[:, 0]] + n - log[lead]) % n], 0)
+            i = np.arange(n - nbits + 1, n + 1)
+            value = np.broadcast_to(syn0[:, None], (len(many), len(i))).copy()
+            for j in range(1, poly.shape[1]):
+                if use[:, j].any():
+                    power = self.exp[(np.maximum(rep[:, j], 0)[:, None] + j * i[None, :]) % n]
+                    value ^= np.where(use[:, j][:, None], power, 0)
+            zero = value == 0
+            zero &= np.cumsum(zero, axis=1) <= deg[:, None]  # the search stops at deg roots
+            count = zero.sum(axis=1)
+            ok = count >= deg
+            # root n-i for search position i, in 0..nbits-1
+            found[many[:, None], (n - i)[None, :]] += zero & ok[:, None]
+            nroots[many] = np.where(ok, deg, -1)
+        return found, nroots
+
+    def decode(self, codewords):
+        """ Decodes a batch of codewords, as BCH.decode of each
+
+        codewords is a bool array (N, nbits). Returns the corrected codewords, a new array,
+        and the number of bitflips corrected per codeword (N,), -1 where it failed to decode.
+        """
+        codewords = np.asarray(codewords, dtype=bool)
+        assert codewords.ndim == 2 and codewords.shape[1] == self.nbits
+        found, nroots = self.roots(*self.error_locators(self.syndromes(codewords)))
+        nroots = np.where(found[:, self.nbits] > 0, -1, nroots)  # a root beyond the codeword fails the decode
+        flips = (found[:, :self.nbits] & 1 == 1) & (nroots >= 0)[:, None]  # a root found twice flips its bit back
+        corrected = codewords ^ flips[:, ::-1]  # root r is the bit of degree r, at nbits-1-r
+        return corrected, nroots
@@ -8,6 +8,15 @@
 
 from dataclasses import dataclass
 from copy import deepcopy
+import os
+import threading
+
+
+BCH_TABLES = dict()  # (t, poly) -> tables of the code, shared by every BCH built for it
+BCH_TABLE_NAMES = ('exponents', 'logarithms', 'elp_pre', 'cyclic_tab')
+# tables written by save_bch_tables (see scripts/export_bch_tables.py), read if present before the first table is built
+BCH_TABLES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'bch_tables.npz')
+BCH_TABLES_LOCK = threading.Lock()
 
 
 class BCH(object):
@@ -92,6 +101,7 @@ class BCH(object):
 
 
    def getroots(self, k, poly):
+      # roots of the error locator poly of a codeword of k data bytes, None if it has too few
 
       roots=[]
       
@@ -121,8 +131,7 @@ class BCH(object):
                      break
          if len(roots)<poly.deg:
              # not enough roots to correct
-             self.ECCstate.errloc=[]
-             return -1
+             return None
 
       if poly.deg==1:
          if (poly.c[0]):
@@ -146,8 +155,7 @@ class BCH(object):
                roots.append(self.modn(2*self.ECCstate.n-l1-self.ECCstate.logarithms[r^1]+l2))
 
 
-      self.ECCstate.errloc=roots  
-      return len(roots)
+      return roots
 
    def get_ecc_bits(self):
       return self.ECCstate.ecc_bits
@@ -158,10 +166,9 @@ class BCH(object):
 
 
    def decode(self,data,recvecc): 
+      # all scratch is local, so one BCH can decode in several threads at once
                 
-      calc_ecc=self.encode(data)
-                
-      self.ECCstate.errloc=[]
+      ecc_buf=self.ecc_words(data)
                 
       ecclen=len(recvecc)
       mlen=int(ecclen/4) # how many whole words
@@ -183,8 +190,8 @@ class BCH(object):
       
       sum=0
       for i in range(0,eccwords):
-         self.ECCstate.ecc_buf[i] = self.ECCstate.ecc_buf[i] ^ eccbuf[i]
-         sum = sum | self.ECCstate.ecc_buf[i]
+         ecc_buf[i] = ecc_buf[i] ^ eccbuf[i]
+         sum = sum | ecc_buf[i]
       if sum==0:
         return 0 # no bit flips
       
@@ -195,7 +202,7 @@ class BCH(object):
       
       m= s & 31  
 
-      synbuf=self.ECCstate.ecc_buf
+      synbuf=ecc_buf
       
       if (m):
         synbuf[int(s/32)] = synbuf[int(s/32)] & ~(pow(2,32-m)-1)
@@ -256,21 +263,23 @@ class BCH(object):
              d=syn[2*i+2]
              for j in range(1,(elp.deg+1)):
                  d = d ^ self.g_mul(elp.c[j],syn[2*i+2-j])
-      self.ECCstate.elp=elp
 
 
-      nroots = self.getroots(len(data),self.ECCstate.elp)
+      errloc = self.getroots(len(data),elp)
+      if errloc is None:
+          return -1
+      nroots = len(errloc)
       datalen=len(data)
       nbits=(datalen*8)+self.ECCstate.ecc_bits
 
       for i in range(0,nroots):
-          if self.ECCstate.errloc[i] >= nbits:
+          if errloc[i] >= nbits:
             return -1
-          self.ECCstate.errloc[i]=nbits-1-self.ECCstate.errloc[i]
-          self.ECCstate.errloc[i]=(self.ECCstate.errloc[i] & ~7) | (7-(self.ECCstate.errloc[i] & 7))
+          errloc[i]=nbits-1-errloc[i]
+          errloc[i]=(errloc[i] & ~7) | (7-(errloc[i] & 7))
         
 
-      for bitflip in self.ECCstate.errloc:
+      for bitflip in errloc:
           byte= int (bitflip / 8)
           bit = pow(2,(bitflip & 7))
           if bitflip < (len(data)+len(recvecc))*8:
@@ -285,6 +294,23 @@ class BCH(object):
 
    def encode(self,data):
 
+      r=self.ecc_words(data)
+      eccout=[]
+      for e in r:
+         eccout.append((e >> 24) & 0xff)
+         eccout.append((e >> 16) & 0xff)
+         eccout.append((e >> 8) & 0xff)
+         eccout.append((e >> 0) & 0xff)
+
+      eccout=eccout[0:self.ECCstate.ecc_bytes]
+
+      eccbytes=(bytearray(bytes(eccout)))
+      return eccbytes
+
+
+   def ecc_words(self,data):
+      # ecc of data as a new list of 32 bit words, MSB first
+
       datalen=len(data)
       l=self.ceilop(self.ECCstate.m*self.ECCstate.t, 32)-1
 
@@ -331,18 +357,7 @@ class BCH(object):
           ecc[l]=((ecc[l] << 8)&0xffffffff)^(self.ECCstate.cyclic_tab[pidx])
           leftdata -= 1
 
-      self.ECCstate.ecc_buf=ecc
-      eccout=[]
-      for e in r:
-         eccout.append((e >> 24) & 0xff)
-         eccout.append((e >> 16) & 0xff)
-         eccout.append((e >> 8) & 0xff)
-         eccout.append((e >> 0) & 0xff)
-
-      eccout=eccout[0:self.ECCstate.ecc_bytes]
-
-      eccbytes=(bytearray(bytes(eccout)))
-      return eccbytes
+      return ecc
 
 
 
@@ -388,10 +403,6 @@ class BCH(object):
       self.ECCstate.n=pow(2,m)-1
       words = self.ceilop(m*t,32)
       self.ECCstate.ecc_bytes = self.ceilop(m*t,8)
-      self.ECCstate.cyclic_tab=[0]*(words*1024)
-      self.ECCstate.syn=[0]*(2*t)
-      self.ECCstate.elp=[0]*(t+1)
-      self.ECCstate.errloc=[0] * t
  
 
       x=1
@@ -399,6 +410,14 @@ class BCH(object):
       if k != pow(2,self.ECCstate.m):
         return -1
 
+      tables = shared_tables(t, poly)
+      if tables is not None:
+         for name in BCH_TABLE_NAMES:
+            setattr(self.ECCstate, name, tables[name])
+         self.ECCstate.ecc_bits=tables['ecc_bits']
+         return
+
+      self.ECCstate.cyclic_tab=[0]*(words*1024)
       self.ECCstate.exponents=[0]*(1+self.ECCstate.n)
       self.ECCstate.logarithms=[0]*(1+self.ECCstate.n)
       self.ECCstate.elp_pre=[0]*(1+self.ECCstate.m)
@@ -490,7 +509,265 @@ class BCH(object):
             y=y^aexp
          x += 1
 
+      tables = {name: getattr(self.ECCstate, name) for name in BCH_TABLE_NAMES}
+      tables['ecc_bits']=self.ECCstate.ecc_bits
+      BCH_TABLES.setdefault((t, poly), tables)
+
 
 
 
       
+
+
+def shared_tables(t, poly):
+   # tables of the (t, poly) code if built or loaded already, else None
+   if BCH_TABLES_FILE and not BCH_TABLES:
+      with BCH_TABLES_LOCK:
+         if not BCH_TABLES and os.path.isfile(BCH_TABLES_FILE):
+            try:
+               load_bch_tables(BCH_TABLES_FILE)
+            except Exception as e:
+               # the file is only a cache, the tables are built instead
+               print('Warning: ignoring unreadable BCH tables file %s: %s' % (BCH_TABLES_FILE, e))
+   return BCH_TABLES.get((t, poly))
+
+
+def valid_tables(t, poly, tables):
+   # whether tables have the sizes of the (t, poly) code and consistent log/antilog tables
+   m = poly.bit_length()-1
+   n = pow(2,m)-1
+   sizes = {'exponents': n+1, 'logarithms': n+1, 'elp_pre': m+1, 'cyclic_tab': 1024*((m*t+31)//32)}
+   if m < 2 or t < 1 or any(len(tables[name]) != size for name, size in sizes.items()):
+      return False
+   if not 0 < tables['ecc_bits'] <= m*t:
+      return False
+   exponents, logarithms = tables['exponents'], tables['logarithms']
+   return exponents[n] == 1 and all(0 < exponents[i] <= n and logarithms[exponents[i]] == i for i in range(n))
+
+
+def save_bch_tables(path):
+   """ Writes the tables of every BCH code built so far to path, a numpy .npz file """
+   import numpy as np
+   arrays = dict()
+   for (t, poly), tables in BCH_TABLES.items():
+      for name in BCH_TABLE_NAMES:
+         arrays['%d_%d_%s' % (t, poly, name)] = np.array(tables[name], dtype=np.uint32)
+      arrays['%d_%d_ecc_bits' % (t, poly)] = np.array([tables['ecc_bits']], dtype=np.uint32)
+   with open(path, 'wb') as f:
+      np.savez_compressed(f, **arrays)
+
+
+def load_bch_tables(path):
+   """ Adds the tables written by save_bch_tables to the shared cache, returns the number of codes read
+
+   Codes whose tables are missing or do not fit the code are skipped (and built when needed).
+   """
+   import numpy as np
+   codes = 0
+   with np.load(path) as arrays:
+      for key in arrays.files:
+         if not key.endswith('_ecc_bits'):
+            continue
+         t, poly = (int(v) for v in key[:-len('_ecc_bits')].split('_'))
+         names = ['%d_%d_%s' % (t, poly, name) for name in BCH_TABLE_NAMES]
+         if any(name not in arrays.files for name in names):
+            print('Warning: incomplete BCH tables for t=%d poly=%d in %s' % (t, poly, path))
+            continue
+         tables = {name: arrays[stored].tolist() for name, stored in zip(BCH_TABLE_NAMES, names)}
+         tables['ecc_bits'] = int(arrays[key].ravel()[0])
+         if not valid_tables(t, poly, tables):
+            print('Warning: ignoring BCH tables for t=%d poly=%d in %s, they do not fit the code' % (t, poly, path))
+            continue
+         BCH_TABLES.setdefault((t, poly), tables)
+         codes += 1
+   return codes
+
+
+class BCHFast(BCH):
+   """ BCH with a fast decode of single codewords, same results as BCH.decode
+
+   Meant for the short codes of the watermark (m=7, t=3/4/5/8, about 100 bit codewords):
+   syndromes come from per byte tables, Berlekamp-Massey runs on plain lists and the Chien
+   search is a lookup of bit planes across all codeword positions, all in integer arithmetic.
+   The tables depend on the data length and are built on first use of each length, once
+   per code like the BCH tables.
+   """
+
+   def __init__(self, t, poly):
+      super().__init__(t, poly)
+      n=self.ECCstate.n
+      shared=BCH_TABLES[(t, poly)]
+      if 'exp_ext' not in shared:
+         shared['square']=[self.g_sqrt(a) for a in range(n+1)]  # g_sqrt squares
+         shared['exp_ext']=[self.ECCstate.exponents[i % n] for i in range(4*n)]  # alpha^i without reducing i
+      self.exp_ext=shared['exp_ext']
+      self.square=shared['square']
+      self.tables=shared.setdefault('decode', dict())  # datalen -> (syndrome table, chien planes)
+
+   def decode_tables(self, datalen):
+      # (syndrome table, chien planes) of a codeword with datalen data bytes
+      tables=self.tables.get(datalen)
+      if tables is None:
+         # threads racing here build the same tables, the first one stored is kept
+         tables=self.tables.setdefault(datalen, (self.build_syndrome_table(datalen), self.build_chien_planes(datalen)))
+      return tables
+
+   def build_syndrome_table(self, datalen):
+      # table[byte][value]: odd syndromes S_1,S_3,..S_2t-1 of one codeword byte, packed m bits each;
+      # ecc bits past ecc_bits are ignored as BCH.decode masks them
+      m, t, n = self.ECCstate.m, self.ECCstate.t, self.ECCstate.n
+      nbits=datalen*8+self.ECCstate.ecc_bits
+      bit_syn=[]
+      for p in range(nbits):
+         deg=nbits-1-p
+         s=0
+         for i in range(t):
+            s |= self.ECCstate.exponents[((2*i+1)*deg) % n] << (m*i)
+         bit_syn.append(s)
+      table=[]
+      for b in range(self.ceilop(nbits, 8)):
+         row=[0]*256
+         for v in range(1, 256):
+            s=0
+            for bit in range(8):
+               p=8*b+bit
+               if (v & (0x80 >> bit)) and p < nbits:
+                  s ^= bit_syn[p]
+            row[v]=s
+         table.append(row)
+      return table
+
+   def build_chien_planes(self, datalen):
+      # planes[j][r][b]: bit b of alpha^(r+j*i) for every search position i of getroots, one int
+      # bit per position (lowest bit the first i searched), so a polynomial is evaluated at all
+      # positions with a few XORs
+      m, t, n, poly = self.ECCstate.m, self.ECCstate.t, self.ECCstate.n, self.ECCstate.poly
+      nbits=datalen*8+self.ECCstate.ecc_bits
+      positions=range(n-nbits+1, n+1)
+      planes=[]
+      for j in range(2*t):
+         bits=[0]*m
+         for q, i in enumerate(positions):
+            a=self.ECCstate.exponents[(j*i) % n]
+            for b in range(m):
+               if a >> b & 1:
+                  bits[b] |= 1 << q
+         by_rep=[bits]
+         for r in range(1, n):
+            # multiplying by alpha shifts every element up a bit, reducing by poly
+            top=bits[m-1]
+            bits=[(bits[b-1] if b else 0) ^ (top if poly >> b & 1 else 0) for b in range(m)]
+            by_rep.append(bits)
+         planes.append(by_rep)
+      return planes
+
+   def decode(self, data, recvecc):
+      # as BCH.decode: corrects data in place, returns the bitflips corrected or -1
+      n, m, t = self.ECCstate.n, self.ECCstate.m, self.ECCstate.t
+      log, exp = self.ECCstate.logarithms, self.exp_ext
+      datalen=len(data)
+      nbits=datalen*8+self.ECCstate.ecc_bits
+      table, planes = self.decode_tables(datalen)
+
+      s=0
+      for b, v in enumerate(data):
+         s ^= table[b][v]
+      for b, v in enumerate(recvecc[:len(table)-datalen]):
+         s ^= table[datalen+b][v]
+      if s==0:
+         return 0 # no bit flips
+
+      syn=[0]*(2*t)
+      mask=(1 << m)-1
+      for i in range(t):
+         syn[2*i]=(s >> (m*i)) & mask
+      for i in range(t):
+         syn[2*i+1]=self.square[syn[i]]
+
+      # Berlekamp-Massey, as BCH.decode
+      pp=-1
+      pd=1
+      pelp=[1]+[0]*(2*t-1)
+      pelp_deg=0
+      elp=[1]+[0]*(2*t-1)
+      elp_deg=0
+      d=syn[0]
+      for i in range(t):
+         if elp_deg>t:
+            break
+         if d:
+            k=2*i-pp
+            elp_copy=elp[:]
+            copy_deg=elp_deg
+            tmp=log[d]+n-log[pd]
+            for j in range(pelp_deg+1):
+               if pelp[j]:
+                  elp[j+k] ^= exp[tmp+log[pelp[j]]]
+            tmp=pelp_deg+k
+            if tmp>elp_deg:
+               elp_deg=tmp
+               pelp=elp_copy
+               pelp_deg=copy_deg
+               pd=d
+               pp=2*i
+         if i<t-1:
+            d=syn[2*i+2]
+            for j in range(1, elp_deg+1):
+               a, b = elp[j], syn[2*i+2-j]
+               if a and b:
+                  d ^= exp[log[a]+log[b]]
+
+      # roots, as BCH.getroots
+      roots=[]
+      if elp_deg>2:
+         l=n-log[elp[elp_deg]]
+         syn0=exp[log[elp[0]]+n-log[elp[elp_deg]]] if elp[0] else 0
+         value=[-(syn0 >> b & 1) for b in range(m)]  # all ones planes where syn0 has the bit
+         for j in range(1, elp_deg+1):
+            if j==elp_deg:
+               rep=0
+            elif elp[j]:
+               rep=log[elp[j]]+l
+               if rep>=n:
+                  rep -= n
+            else:
+               continue
+            bits=planes[j][rep]
+            for b in range(m):
+               value[b] ^= bits[b]
+         nonzero=0
+         for b in range(m):
+            nonzero |= value[b]
+         zero=~nonzero & ((1 << nbits)-1)
+         while zero and len(roots)<elp_deg:
+            low=zero & -zero
+            roots.append(nbits-1-(low.bit_length()-1))  # root n-i of search position i=n-nbits+1+q
+            zero ^= low
+         if len(roots)<elp_deg:
+            return -1 # not enough roots to correct
+      elif elp_deg==1:
+         if elp[0]:
+            root=n-log[elp[0]]+log[elp[1]]
+            roots.append(root if root<n else root-n)
+      elif elp_deg==2:
+         if elp[0] and elp[1]:
+            l0, l1, l2 = log[elp[0]], log[elp[1]], log[elp[2]]
+            u=exp[l0+l2+2*(n-l1)]
+            r=0
+            v=u
+            while v:
+               i=v.bit_length()-1
+               r ^= self.ECCstate.elp_pre[i]
+               v ^= 1 << i
+            if self.square[r]^r==u:
+               roots.append((2*n-l1-log[r]+l2) % n)
+               roots.append((2*n-l1-log[r^1]+l2) % n)
+
+      for root in roots:
+         if root>=nbits:
+            return -1
+      for root in roots:
+         p=nbits-1-root
+         if p<datalen*8:
+            data[p >> 3] ^= 0x80 >> (p & 7)
+      return len(roots)
@@ -5,11 +5,27 @@
 # accordance with the terms of the Adobe license agreement accompanying
 # it.
 
+import threading
 import numpy as np 
 from typing import List, Tuple
-from copy import deepcopy
+from math import comb
+from collections import OrderedDict
 
 BCH_POLYNOMIAL = 137
+SCHEMAS = (0, 1, 2, 3)  # BCH_SUPER, BCH_5, BCH_4, BCH_3
+CHASE_BITS = 6  # least reliable bits flipped by soft decision decoding, trying up to 2**CHASE_BITS-1 patterns
+CHASE_MISCORRECTION = 1e-3  # bound on the chance that soft decoding accepts a wrong codeword from a random read
+PAYLOAD_CACHE_SIZE = 10000  # encoded packets kept by DataLayer.encode_payloads, about 200 bytes each with the key, see set_payload_cache_size
+PAYLOAD_CACHE_CHUNK = 10000  # secrets encoded per batch when precomputing
+
+DECODE_CACHE_SIZE = 1024  # decode results kept by DataLayer.decode_bitstream_detail
+BATCH_DECODE_MIN = 32  # packets of one schema below which the single codeword decoder beats BCHBatch
+
+PAYLOAD_CACHE = OrderedDict()  # (secret, MODE, encoding_mode, payload_len) -> packed packet, least recently used first
+PAYLOAD_CACHE_LOCK = threading.Lock()
+DECODE_CACHE = OrderedDict()  # (packed bits, MODE, payload_len) -> (secret, detected, version, bitflips)
+DECODE_CACHE_STATS = dict(hits=0, misses=0)
+DECODE_CACHE_LOCK = threading.Lock()
 
 class DataLayer(object):
     def __init__(self, payload_len, verbose=True, encoding_mode=0, **kw_args):
@@ -45,113 +61,299 @@ class DataLayer(object):
             return 75
         return 0
 
+    def schemaCorrectable(self, version):
+        # bit errors the schema's BCH code corrects
+        if version==0:
+            return 8
+        if version==1:
+            return 5
+        if version==2:
+            return 4
+        if version==3:
+            return 3
+        return 0
+
+
+    def schemaDecoder(self, version):
+        # prebuilt BCH decoder of the schema, None if unknown
+        if version==0:
+            return self.bch_decoders[5]
+        if version in (1, 2, 3):
+            return self.bch_decoders[version]
+        return None
+
+
+    def schemaBatch(self, version):
+        # NumPy engine decoding batches of packets of the schema
+        return batch_engine(self.schemaDecoder(version), (self.schemaCapacity(version) + 7) // 8)
+
 
     def buildBCH(self, encoding_mode):
         if encoding_mode==1:
-             return (BCH(5,BCH_POLYNOMIAL))
+             return (BCHFast(5,BCH_POLYNOMIAL))
         elif encoding_mode==2:
-             return (BCH(4,BCH_POLYNOMIAL))
+             return (BCHFast(4,BCH_POLYNOMIAL))
         elif encoding_mode==3:
-             return (BCH(3,BCH_POLYNOMIAL))
+             return (BCHFast(3,BCH_POLYNOMIAL))
         else:  # assume superwatermark/mode 0
-             return(BCH(8,BCH_POLYNOMIAL))
+             return(BCHFast(8,BCH_POLYNOMIAL))
 
 
     def raw_payload_split(self, packet):
+        # splits a packet by the schema its version bits name
+        # returns (correctable bitflips, data bits, ecc bits, BCH decoder, version), the bits as bool arrays
 
-        packet = ''.join([str(int(bit)) for bit in packet])  # bit string
+        packet = np.asarray(packet).astype(np.int64) != 0  # as int(bit) of each value
 
-        wm_version = int(packet[-(self.versionbits-2):],2) # from last 2 bits of the 4 version bits
+        wm_version = int(packet[-2])*2 + int(packet[-1])  # from last 2 bits of the 4 version bits
 #        print('Found watermark with encoding schema %s' % self.schemaInfo(wm_version))
 
-        if wm_version==1:
-                # 5 bitflips via 35 ecc bits, 61 bit payload
-                data=packet[0:61]
-                ecc=packet[61:96]
-                bitflips=5
-                decoder=self.bch_decoders[1]
-        elif wm_version==2:
-                # 4 bitflips via 28 ecc bits, 68 bit payload
-                data=packet[0:68]
-                ecc=packet[68:96]
-                bitflips=4
-                decoder=self.bch_decoders[2]
-        elif wm_version==3:
-                # 3 bitflips via 21 ecc bits, 75 bit payload
-                data=packet[0:75]
-                ecc=packet[75:96]
-                bitflips=3
-                decoder=self.bch_decoders[3]
-        elif wm_version==0:
-                # 8 bitflips via 56 ecc bits, 40 bit payload
-                data=packet[0:40]
-                ecc=packet[40:96]
-                bitflips=8
-                decoder=self.bch_decoders[5]
-        else:
-                data=''
-                ecc=''
-                bitflips=-1
-                decoder=None
-
-        if decoder:
-                bitflips=decoder.ECCstate.t
+        decoder = self.schemaDecoder(wm_version)
+        if decoder is None:
+                return (-1, packet[:0], packet[:0], None, wm_version)  # unsupported or corrupt wmark
 
-        return (bitflips,data,ecc,decoder,wm_version)  # unsupported or corrupt wmark
+        # BCH_SUPER 40 data + 56 ecc bits, BCH_5 61 + 35, BCH_4 68 + 28, BCH_3 75 + 21
+        capacity = self.schemaCapacity(wm_version)
+        data = packet[0:capacity]
+        ecc = packet[capacity:self.payload_len-self.versionbits]
+        return (decoder.ECCstate.t, data, ecc, decoder, wm_version)
 
 
 
     def encode_text(self, text: List[str]):
-        return np.array([self._encode_text(t) for t in text])
+        data = np.zeros((len(text), self.data_bitcount()), dtype=bool)
+        for row, t in zip(data, text):
+            bits = ascii7_bits(t)[:data.shape[1]]
+            row[:len(bits)] = bits
+        return self.encode_bitstream(data)
 
     def encode_binary(self, text: List[str]):
-        return np.array([self._encode_binary(t) for t in text])
+        data = np.zeros((len(text), self.data_bitcount()), dtype=bool)
+        for row, t in zip(data, text):
+            bits = string_bits(str(t))[:data.shape[1]]
+            row[:len(bits)] = bits
+        return self.encode_bitstream(data)
 
     def _encode_binary(self, strbin):
         return self.process_encode(str(strbin))
 
     def _encode_text(self, text: str):
-        data = self.encode_text_ascii(text)  # bytearray
-        packet_d = ''.join(format(x, '08b') for x in data)
-        return self.process_encode(packet_d)
+        return self.encode_bitstream(ascii7_bits(text)[None])[0]
+
+    def data_bitcount(self):
+        # payload bits of the encoding schema
+        return self.payload_len-self.bch_encoder.get_ecc_bits()-self.versionbits
 
     def process_encode(self,packet_d):
-        data_bitcount=self.payload_len-self.bch_encoder.get_ecc_bits()-self.versionbits
-        ecc_bitcount=self.bch_encoder.get_ecc_bits()
+        # packet of a bit string, float32 (payload_len,)
+        return self.encode_bitstream(string_bits(packet_d)[None])[0]
 
-        packet_d=packet_d[0:data_bitcount]
-        packet_d = packet_d+'0'*(data_bitcount-len(packet_d))
+    def encode_bitstream(self, data: np.array):
+        """ Packets of the encoding schema from rows of data bits, float32 (N, payload_len)
 
-        if (len(packet_d)%8)==0:
-           pad_d=0
-        else:
-           pad_d=8-len(packet_d)% 8
-        paddedpacket_d = packet_d + ('0'*pad_d)
-        padded_data = bytearray(bytes(int(paddedpacket_d[i: i + 8], 2) for i in range(0, len(paddedpacket_d), 8)))
- 
-        ecc = self.bch_encoder.encode(padded_data)  
+        Each row of data (N, any length) is cut or zero padded to the schema's data bits,
+        followed by their ecc bits, computed for all rows at once by the schema's BCHBatch,
+        and the encoding mode in the 4 version bits.
+        """
+        assert len(data.shape)==2
+        data_bitcount=self.data_bitcount()
+        ecc_bitcount=self.bch_encoder.get_ecc_bits()
+        assert 0 <= self.encoding_mode < 1 << self.versionbits,f'Error! Could not form complete packet'
+        engine = batch_engine(self.bch_encoder, (data_bitcount + 7) // 8)
 
-        packet_e = ''.join(format(x, '08b') for x in ecc)
-        packet_e = packet_e[0:ecc_bitcount]
-        if (len(packet_e)%8)==0 or not (self.encoding_mode==0):
-           pad_e=0
-        else:
-           pad_e=8-len(packet_e)% 8
-        packet_e = packet_e + ('0'*pad_e)
-
-        version=self.encoding_mode
-        packet_v = ''.join(format(version, '04b'))
-        packet = packet_d + packet_e + packet_v
-        packet = [int(x) for x in packet]
-        assert self.payload_len == len(packet),f'Error! Could not form complete packet'
-        packet = np.array(packet, dtype=np.float32)
+        padded_data = np.zeros((len(data), engine.data_bits), dtype=bool)
+        width = min(data.shape[1], data_bitcount)
+        padded_data[:, :width] = np.asarray(data[:, :width]) != 0
+
+        packet = np.zeros((len(data), self.payload_len), dtype=np.float32)
+        packet[:, :data_bitcount] = padded_data[:, :data_bitcount]
+        packet[:, data_bitcount:data_bitcount+ecc_bitcount] = engine.encode(padded_data)
+        packet[:, -self.versionbits:] = (self.encoding_mode >> np.arange(self.versionbits)[::-1]) & 1
         return packet
     
+    def encode_payloads(self, secrets: List[str], MODE='text'):
+        """ Packets of secrets (text, or bit strings for MODE=binary), float32 (N, payload_len)
+
+        As encode_text/encode_binary, through a process-wide LRU of PAYLOAD_CACHE_SIZE packets
+        shared by every DataLayer, so re-embedding an ID skips the ascii packing and BCH encode.
+        The misses are encoded together in one batch.
+        """
+        MODE = 'binary' if MODE=='binary' else 'text'
+        secrets = [str(s) if MODE=='binary' else s for s in secrets]
+        schema = (MODE, self.encoding_mode, self.payload_len)
+        with PAYLOAD_CACHE_LOCK:
+            packed = [PAYLOAD_CACHE.get((s,) + schema) for s in secrets]
+            for s, p in zip(secrets, packed):
+                if p is not None:
+                    PAYLOAD_CACHE.move_to_end((s,) + schema)
+        missing = [i for i, p in enumerate(packed) if p is None]
+        if missing:
+            new = list(dict.fromkeys(secrets[i] for i in missing))  # each distinct secret once
+            encoded = self.encode_binary(new) if MODE=='binary' else self.encode_text(new)
+            encoded = dict(zip(new, (p.tobytes() for p in np.packbits(encoded != 0, axis=1))))
+            with PAYLOAD_CACHE_LOCK:
+                for s, p in encoded.items():
+                    PAYLOAD_CACHE[(s,) + schema] = p
+                while len(PAYLOAD_CACHE) > PAYLOAD_CACHE_SIZE:
+                    PAYLOAD_CACHE.popitem(last=False)
+            for i in missing:
+                packed[i] = encoded[secrets[i]]
+        packed = np.frombuffer(b''.join(packed), dtype=np.uint8).reshape(len(secrets), -(-self.payload_len // 8))
+        return np.unpackbits(packed, axis=1, count=self.payload_len).astype(np.float32)
+
+    def precompute_payloads(self, secrets: List[str], MODE='text'):
+        # fills the payload cache for a whole print run ahead of embedding, in batches of PAYLOAD_CACHE_CHUNK;
+        # runs longer than PAYLOAD_CACHE_SIZE only keep their last PAYLOAD_CACHE_SIZE packets, raise it first for big runs
+        secrets = list(secrets)
+        for i in range(0, len(secrets), PAYLOAD_CACHE_CHUNK):
+            self.encode_payloads(secrets[i:i+PAYLOAD_CACHE_CHUNK], MODE)
+        return len(secrets)
+
     def decode_bitstream(self, data: np.array, MODE='text'):
         assert len(data.shape)==2
-        return [self._decode_text(d, MODE) for d in data]
+        return [result[:3] for result in self.decode_bitstream_detail(data, MODE)]
+
+    def decode_bitstream_detail(self, data: np.array, MODE='text'):
+        """ As decode_bitstream, with the number of corrected bitflips (-1 if not decoded) as a fourth value
+
+        Results are kept in a process-wide LRU of DECODE_CACHE_SIZE packets keyed by the packed
+        bits and MODE, so repeated reads (camera frames, retries of one photo) skip the BCH
+        decode; the rest are decoded together by decode_packets.
+        """
+        assert len(data.shape)==2
+        bits = np.asarray(data).astype(np.int64) != 0  # as the int(bit) of raw_payload_split
+        keys = [(packed.tobytes(), MODE, self.payload_len) for packed in np.packbits(bits, axis=1)]
+        with DECODE_CACHE_LOCK:
+            results = [DECODE_CACHE.get(key) for key in keys]
+            for key, result in zip(keys, results):
+                if result is not None:
+                    DECODE_CACHE.move_to_end(key)
+            missing = [i for i, result in enumerate(results) if result is None]
+            DECODE_CACHE_STATS['hits'] += len(keys) - len(missing)
+            DECODE_CACHE_STATS['misses'] += len(missing)
+        if missing:
+            rows = list(dict((keys[i], i) for i in missing).values())  # each distinct packet once
+            decoded = dict(zip((keys[i] for i in rows), self.decode_packets(bits[rows], MODE)))
+            with DECODE_CACHE_LOCK:
+                DECODE_CACHE.update(decoded)
+                while len(DECODE_CACHE) > DECODE_CACHE_SIZE:
+                    DECODE_CACHE.popitem(last=False)
+            for i in missing:
+                results[i] = decoded[keys[i]]
+        return results
+
+    def decode_packets(self, bits: np.array, MODE='text'):
+        """ Decodes packets (N, payload_len) of bool bits, as _decode_packet of each
+
+        The packets of each schema are BCH decoded together by its BCHBatch engine, only
+        formatting the results is done packet by packet; schemas with fewer than
+        BATCH_DECODE_MIN packets are decoded one by one.
+        """
+        versions = bits[:, -2] * 2 + bits[:, -1]
+        n = self.payload_len - self.versionbits
+        results = [None] * len(bits)
+        for version in np.unique(versions):
+            rows = np.flatnonzero(versions == version)
+            if len(rows) < BATCH_DECODE_MIN:
+                for row in rows:
+                    results[row] = self._decode_packet(bits[row], MODE)
+                continue
+            engine = self.schemaBatch(version)
+            k = self.schemaCapacity(version)
+            codewords = np.zeros((len(rows), engine.nbits), dtype=bool)
+            codewords[:, :k] = bits[rows, :k]
+            codewords[:, engine.data_bits:] = bits[rows, k:n]
+            corrected, bitflips = engine.decode(codewords)
+            packets = np.where((bitflips >= 0)[:, None], corrected, codewords)
+            if MODE=='text':
+                secrets = [bytes(codes).decode('utf-8').rstrip('\x00').strip() for codes in ascii7_codes(packets[:, :engine.data_bits])]
+            else:
+                secrets = bit_strings(packets[:, :k])
+            for row, secret, flips in zip(rows, secrets, bitflips):
+                results[row] = (secret, bool(flips >= 0), int(version), int(flips))
+        return results
+
+
+
+    def decode_all_schemas(self, data: np.array, MODE='text', schemas=SCHEMAS):
+        # as decode_bitstream_detail, decoding each packet with every schema in schemas rather than
+        # the one its version bits name, see _decode_schemas
+        assert len(data.shape)==2
+        return [self._decode_schemas(d, MODE, schemas) for d in data]
 
+    def _decode_schemas(self, packet: np.array, MODE, schemas=SCHEMAS):
+        """ Decodes one packet with each schema in schemas, recovering packets whose version bits are corrupt
 
+        Returns the valid decode with the fewest bitflips as (secret, detected, version, bitflips),
+        ties going to the schema the version bits name, then to the order of schemas. Without any,
+        the failed decode of the named schema is returned. The packet itself is left untouched.
+        """
+        assert len(packet.shape)==1
+        packet = np.asarray(packet) > 0.5
+        named = int(packet[-2])*2 + int(packet[-1])  # last 2 of the version bits, as raw_payload_split
+        n = self.payload_len - self.versionbits
+        best, best_bitflips = None, n
+        for version in sorted(schemas, key=lambda v: v != named):
+            bch_decoder = self.schemaDecoder(version)
+            if bch_decoder is None:
+                continue
+            k = self.schemaCapacity(version)
+            data = bytearray(np.packbits(packet[:k]).tobytes())
+            ecc = bytearray(np.packbits(packet[k:n]).tobytes())
+            bitflips = bch_decoder.decode(data, ecc)
+            if 0 <= bitflips < best_bitflips:
+                best, best_bitflips = version, bitflips
+        if best is None:
+            return self._decode_packet(packet, MODE)
+        packet = packet.copy()
+        packet[-2:] = [best >> 1, best & 1]
+        return self._decode_packet(packet, MODE)
+
+    def decode_soft(self, logits: np.array, MODE='text', chase_bits=CHASE_BITS):
+        # as decode_bitstream_detail, from decoder logits (N, payload_len) rather than bits,
+        # retrying packets that fail the hard decision with chase_decode
+        assert len(logits.shape)==2
+        results = self.decode_bitstream_detail(logits > 0, MODE)
+        for i, (_, detected, _, _) in enumerate(results):
+            if not detected:
+                results[i] = self.chase_decode(logits[i], MODE, chase_bits)
+        return results
+
+    def chase_decode(self, logits: np.array, MODE='text', chase_bits=CHASE_BITS):
+        """ Soft decision (Chase-II) decode of one packet from its decoder logits (payload_len,)
+
+        The least reliable bits of the codeword (smallest |logit|) are flipped in every
+        combination, most likely combination first, and the first one the BCH code of the
+        packet's schema decodes is accepted. Every pattern is another chance of a wrong
+        codeword, so at most chase_bits are flipped and fewer, possibly none, for codes too
+        weak to keep that chance under CHASE_MISCORRECTION. Returns (secret, detected,
+        version, bitflips), bitflips counting the flipped bits as well as those corrected.
+        """
+        assert len(logits.shape)==1
+        hard = logits > 0
+        correctable, packet_d, packet_e, bch_decoder, version = self.raw_payload_split(hard)
+        if bch_decoder is None:
+            return self._decode_packet(hard, MODE)
+        k, n = len(packet_d), len(packet_d) + len(packet_e)
+        chase_bits = min(chase_bits, chase_budget(n, n - k, correctable))
+        if chase_bits <= 0:
+            return self._decode_packet(hard, MODE)
+        margins = np.abs(logits[:n])
+        weak = np.argsort(margins, kind='stable')[:chase_bits]
+        patterns = chase_patterns(len(weak))
+        patterns = patterns[np.argsort(patterns @ margins[weak], kind='stable')]
+        trials = np.repeat(hard[None], len(patterns), axis=0)
+        trials[:, weak] ^= patterns
+        # every pattern is decoded in one batch, the most likely valid one wins
+        engine = self.schemaBatch(version)
+        codewords = np.zeros((len(trials), engine.nbits), dtype=bool)
+        codewords[:, :k] = trials[:, :k]
+        codewords[:, engine.data_bits:] = trials[:, k:n]
+        valid = np.flatnonzero(engine.decode(codewords)[1] >= 0)
+        if len(valid):
+            secret, detected, version, bitflips = self._decode_packet(trials[valid[0]], MODE)
+            return secret, detected, version, bitflips + int(patterns[valid[0]].sum())
+        return self._decode_packet(hard, MODE)
 
     def decode_text(self, data: np.array):
         assert len(data.shape)==2
@@ -164,72 +366,108 @@ class DataLayer(object):
 
     
     def _decode_text(self, packet: np.array, MODE):
+        return self._decode_packet(packet, MODE)[:3]
+
+    def _decode_packet(self, packet: np.array, MODE):
         assert len(packet.shape)==1
         bitflips, packet_d, packet_e, bch_decoder, version = self.raw_payload_split(packet)
         if (bitflips==-1): # unsupported or corrupt wm
-            return '', False, version
-        if (len(packet_d)%8 ==0):
-           pad_d=0
-        else:
-           pad_d=8-len(packet_d)% 8
-        if (len(packet_e)%8 ==0):
-           pad_e=0
-        else:
-           pad_e=8-len(packet_e)% 8
-        packet_d = packet_d + ('0'*pad_d)
-        packet_e = packet_e + ('0'*pad_e)
-
-        packet_d = bytes(int(packet_d[i: i + 8], 2) for i in range(0, len(packet_d), 8))
-        packet_e = bytes(int(packet_e[i: i + 8], 2) for i in range(0, len(packet_e), 8))
-        data = bytearray(packet_d)
-        ecc = bytearray(packet_e)
-        data0 = self.decode_text_ascii(deepcopy(data)).rstrip('\x00').strip()
+            return '', False, version, -1
+
+        data = bytearray(np.packbits(packet_d).tobytes())  # zero padded to whole bytes
+        ecc = bytearray(np.packbits(packet_e).tobytes())
+        data0 = bytes(data)
         if len(ecc)==bch_decoder.get_ecc_bytes():
             bitflips = bch_decoder.decode(data, ecc) 
         else:
             bitflips = -1 
 #        print('Bitflips = %d' % bitflips)
-        if bitflips == -1:
-            if MODE=='text':
-               data = data0
-               return data, False, version
-            else:
-               dataasc = ''.join(format(x, '08b') for x in data)
-               maxbits=self.schemaCapacity(version)
-               dataasc=dataasc[0:maxbits]
-               return dataasc, False, version
-
+        detected = bitflips != -1
+        if MODE=='text':
+            dataasc = self.decode_text_ascii(data if detected else data0).rstrip('\x00').strip()
         else:
-            if MODE=='text':
-                dataasc = self.decode_text_ascii(data).rstrip('\x00').strip()
-            else:
-                dataasc = ''.join(format(x, '08b') for x in data)
-                maxbits=self.schemaCapacity(version)
-                dataasc=dataasc[0:maxbits]
-            return dataasc, True, version
+            dataasc = bit_strings(np.unpackbits(np.frombuffer(bytes(data), dtype=np.uint8))[None, :len(packet_d)])[0]
+        return dataasc, detected, version, bitflips
 
 
     def encode_text_ascii(self, text: str):
         # encode text to 7-bit ascii
         # input: text, str
         # output: encoded text, bytearray
-        text_int7 = [ord(t) & 127 for t in text]
-        text_bitstr = ''.join(format(t,'07b') for t in text_int7)
-        if len(text_bitstr) % 8 != 0:
-            text_bitstr =  text_bitstr + '0'*(8-len(text_bitstr)%8) # + text_bitstr  # pad to multiple of 8
-        text_int8 = [int(text_bitstr[i:i+8], 2) for i in range(0, len(text_bitstr), 8)]
-        return bytearray(text_int8)
+        return bytearray(np.packbits(ascii7_bits(text)).tobytes())  # zero padded to whole bytes
 
 
     def decode_text_ascii(self, text: bytearray):
         # decode text from 7-bit ascii
         # input: text, bytearray
         # output: decoded text, str
-        text_bitstr = ''.join(format(t,'08b') for t in text)  # bit string
-        text_int7 = [int(text_bitstr[i:i+7], 2) for i in range(0, len(text_bitstr), 7)]
-        text_bytes = bytes(text_int7)
-        return text_bytes.decode('utf-8')
-
+        text_bits = np.unpackbits(np.frombuffer(bytes(text), dtype=np.uint8))
+        return bytes(ascii7_codes(text_bits[None])[0]).decode('utf-8')
+
+
+
+def ascii7_bits(text):
+    # bits of the 7-bit ascii codes of text, MSB first, bool (7*len(text),)
+    codes = (np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32) & 127).astype(np.uint8)
+    return np.unpackbits(codes[:, None], axis=1)[:, 1:].reshape(-1) == 1
+
+def ascii7_codes(bits):
+    # 7-bit ascii codes read from rows of bits (N, L), 7 bits each MSB first, as uint8 (N, ceil(L/7));
+    # as decode_text_ascii always did, a last group of fewer than 7 bits is read as a number of its own
+    N, L = bits.shape
+    full = L // 7 * 7
+    groups = np.zeros((N, -(-L // 7) * 7), dtype=np.uint8)
+    groups[:, :full] = bits[:, :full]
+    groups[:, groups.shape[1] - (L - full):] = bits[:, full:]
+    return np.packbits(groups.reshape(N, -1, 7), axis=2)[:, :, 0] >> 1
+
+def string_bits(packet_d):
+    # bits of a '0'/'1' string, bool (len(packet_d),)
+    return np.frombuffer(packet_d.encode(), dtype=np.uint8) == ord('1')
+
+def bit_strings(bits):
+    # '0'/'1' string of each row of bits (N, L)
+    chars = (np.asarray(bits) != 0).astype(np.uint8) + ord('0')
+    return [row.tobytes().decode() for row in chars]
+
+
+def set_payload_cache_size(size):
+    # bounds the payload cache to size packets (about 200 bytes each), dropping the least recently used beyond it
+    global PAYLOAD_CACHE_SIZE
+    assert size >= 0
+    with PAYLOAD_CACHE_LOCK:
+        PAYLOAD_CACHE_SIZE = size
+        while len(PAYLOAD_CACHE) > PAYLOAD_CACHE_SIZE:
+            PAYLOAD_CACHE.popitem(last=False)
+
+def decode_cache_info():
+    # hits, misses and size of the decode result cache
+    with DECODE_CACHE_LOCK:
+        return dict(DECODE_CACHE_STATS, size=len(DECODE_CACHE), maxsize=DECODE_CACHE_SIZE)
+
+def clear_decode_cache():
+    with DECODE_CACHE_LOCK:
+        DECODE_CACHE.clear()
+        DECODE_CACHE_STATS.update(hits=0, misses=0)
+
+
+CHASE_PATTERNS = dict()
+
+def chase_budget(n, ecc_bits, correctable):
+    # most bits to flip in a chase decode while the patterns tried keep the chance of a random
+    # n bit word decoding (within correctable bits of one of the codewords) under CHASE_MISCORRECTION
+    accept = sum(comb(n, i) for i in range(correctable + 1)) / 2.0**ecc_bits
+    bits = 0
+    while bits < 16 and ((1 << (bits + 1)) - 1) * accept <= CHASE_MISCORRECTION:
+        bits += 1
+    return bits
+
+def chase_patterns(bits):
+    # every non-empty subset of bits positions, as a bool array (2**bits-1, bits)
+    if bits not in CHASE_PATTERNS:
+        masks = np.arange(1, 1 << bits)
+        CHASE_PATTERNS[bits] = (masks[:, None] >> np.arange(bits)) & 1 == 1
+    return CHASE_PATTERNS[bits]
 
 
 ## TESTING ONLY
@@ -274,10 +512,12 @@ def main():
           quit()
 
 if __name__ == "__main__":
-    from bchecc import BCH    
+    from bchecc import BCHFast
+    from bchbatch import batch_engine
     main()
 else:
-    from .bchecc import BCH
+    from .bchecc import BCHFast
+    from .bchbatch import batch_engine
  
 
 
@@ -0,0 +1,43 @@
+# Copyright 2023 Adobe
+# All Rights Reserved.
+
+# NOTICE: Adobe permits you to use, modify, and distribute this file in
+# accordance with the terms of the Adobe license agreement accompanying
+# it.
+
+import torch
+from torch import nn
+
+
+class SecretEncoderInference(nn.Module):
+    # inference-only counterpart of TrustMark_Arch.forward, returns a tuple (stego, residual)
+    def __init__(self, encoder):
+        super().__init__()
+        self.encoder = encoder
+
+    def forward(self, cover, secret):
+        enc_out = self.encoder(cover, secret)
+        if hasattr(self.encoder, 'return_residual') and self.encoder.return_residual:
+            return cover + enc_out, enc_out
+        else:
+            return enc_out, enc_out - cover
+
+
+class SecretDecoderInference(nn.Module):
+    # returns the secret logits (B, secret_len) of the TrustMark_Arch secret decoder
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, image):
+        return self.decoder(image)
+
+
+class WMRemoverInference(nn.Module):
+    # inference-only counterpart of WMRemover.forward
+    def __init__(self, denoise):
+        super().__init__()
+        self.denoise = denoise
+
+    def forward(self, x):
+        return torch.clamp(self.denoise(x), -1, 1)
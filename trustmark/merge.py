@@ -0,0 +1,254 @@
+# Copyright 2023 Adobe
+# All Rights Reserved.
+
+# NOTICE: Adobe permits you to use, modify, and distribute this file in
+# accordance with the terms of the Adobe license agreement accompanying
+# it.
+
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+def feather_ramp(length, alpha_vals):
+    # per row (or column) alpha of a pasted region, ramping up over alpha_vals from both edges
+    # returns the alpha (length,) float32 and the mask of rows inside the feathered bands
+    n = len(alpha_vals)
+    alpha = np.ones(length, dtype=np.float32)
+    alpha[:n] = alpha_vals
+    alpha[length-n:] = alpha_vals[::-1]  # the far edge wins where the bands overlap
+    band = np.zeros(length, dtype=bool)
+    band[:n] = True
+    band[length-n:] = True
+    return alpha, band
+
+def feather_ramps(height, width, feather_size):
+    # row and column ramps of a (height, width) region, as (alpha_rows, row_band, alpha_cols, col_band)
+    alpha_vals = np.arange(1, feather_size + 1, dtype=np.float32) / feather_size
+    feather_size = max(0, min(feather_size, height, width))
+    return feather_ramp(height, alpha_vals[:feather_size]) + feather_ramp(width, alpha_vals[:feather_size])
+
+def feather_blend(wm, cover, alpha_rows, row_band, alpha_cols, col_band):
+    # blends the feathered border of wm (n,w,3) float32 with cover (n,w,3) in place, the rows
+    # being any run of region rows described by alpha_rows/row_band; columns win in the corners
+    rows = np.flatnonzero(row_band)
+    if len(rows):
+        alpha = np.where(col_band[None, :], alpha_cols[None, :], alpha_rows[rows, None])[:, :, None]
+        wm[rows] = alpha * wm[rows] + (1.0 - alpha) * cover[rows]
+    rows, cols = np.flatnonzero(~row_band), np.flatnonzero(col_band)
+    if len(rows) and len(cols):
+        alpha = alpha_cols[cols][None, :, None]
+        band = np.ix_(rows, cols)
+        wm[band] = alpha * wm[band] + (1.0 - alpha) * cover[band]
+    return wm
+
+def add_residual(residual, image, strength=1.0):
+    # residual (h,w,3) float32 in model range, image PIL or uint8 (h,w,3)
+    # returns image + strength * residual as float32 (h,w,3) in range [0, 255], computed in place
+    out = np.array(image, dtype=np.float32)
+    out /= 127.5
+    out -= 1.0
+    if strength != 1.0:
+        residual = residual * np.float32(strength)
+    out += residual
+    np.clip(out, -1, 1, out=out)
+    out *= 127.5
+    out += 127.5
+    return out
+
+def residual_rows(residual, y0, y1, height, width, mode='bilinear'):
+    """ Rows y0:y1 of residual (1,3,rh,rw) resized to (height, width), as float32 (y1-y0, width, 3)
+
+    Only the source rows the strip depends on are resampled, so memory follows the
+    strip rather than the full output size. Same sampling as interpolate(align_corners=False).
+    """
+    rh = residual.shape[2]
+    y = np.arange(y0, y1, dtype=np.float32)
+    scale = np.float32(rh) / np.float32(height)
+    if mode == 'bilinear':
+        src = np.maximum(scale * (y + np.float32(0.5)) - np.float32(0.5), 0)
+        h0 = src.astype(np.int64)
+        h1 = h0 + (h0 < rh - 1)
+    elif mode == 'nearest':
+        h0 = h1 = np.minimum(np.floor(y * scale).astype(np.int64), rh - 1)
+    else:
+        raise ValueError('strip-wise merging supports bilinear and nearest, not %s' % mode)
+    s0, s1 = int(h0.min()), int(h1.max()) + 1
+    rows = torch.nn.functional.interpolate(residual[:, :, s0:s1], size=(s1 - s0, width), mode=mode)
+    rows = rows[0].permute(1, 2, 0).cpu().numpy()  # (k,width,3)
+    if mode == 'nearest':
+        return rows[h0 - s0]
+    l1 = (src - h0).astype(np.float32)[:, None, None]
+    return (1 - l1) * rows[h0 - s0] + l1 * rows[h1 - s0]
+
+def merge_strips(strips, residual, region, strength=1.0, mode='bilinear', feather_size=0):
+    """ Adds a residual to the region of an image delivered as horizontal strips
+
+    strips yields uint8 (n,W,3) arrays covering the image from the top; a merged uint8
+    copy of each is yielded in turn. residual is (1,3,rh,rw), resized to the region
+    (left, top, right, bottom) strip by strip, so the working set is a few float32
+    copies of one strip whatever the image size.
+    """
+    left, top, right, bottom = region
+    height, width = bottom - top, right - left
+    if feather_size:
+        alpha_rows, row_band, alpha_cols, col_band = feather_ramps(height, width, feather_size)
+    y = 0
+    for strip in strips:
+        n = strip.shape[0]
+        r0, r1 = max(y, top), min(y + n, bottom)
+        if r1 > r0:
+            strip = np.array(strip)  # sources may be read-only views or memory maps
+            cover = strip[r0-y:r1-y, left:right]
+            wm = add_residual(residual_rows(residual, r0 - top, r1 - top, height, width, mode), cover, strength)
+            if feather_size:
+                rows = slice(r0 - top, r1 - top)
+                feather_blend(wm, cover, alpha_rows[rows], row_band[rows], alpha_cols, col_band)
+            strip[r0-y:r1-y, left:right] = wm
+        y += n
+        yield strip
+
+RESAMPLE_PRECISION_BITS = 22  # fixed point bits of PIL's 8-bit resampling
+
+def bilinear_taps(size, resolution):
+    """ The taps of PIL's Image.BILINEAR resize of size samples to resolution
+
+    Returns (first, weights): first (resolution,) source index of each output sample and
+    weights (resolution, taps) float64 holding PIL's integer fixed point coefficients,
+    computed as PIL does so that resampling with them gives the same pixels as resize().
+    """
+    scale = size / resolution
+    filterscale = max(scale, 1.0)
+    support = filterscale  # the triangle filter reaches 1 source pixel, stretched when downsampling
+    taps = int(np.ceil(support)) * 2 + 1
+    first = np.zeros(resolution, dtype=np.int64)
+    weights = np.zeros((resolution, taps), dtype=np.float64)
+    for i in range(resolution):
+        center = (i + 0.5) * scale
+        lo = max(int(center - support + 0.5), 0)
+        hi = min(int(center + support + 0.5), size)
+        w = np.maximum(1.0 - np.abs((np.arange(lo, hi) - center + 0.5) * (1.0 / filterscale)), 0.0)
+        total = sum(w.tolist())  # summed in order, as PIL does
+        if total != 0.0:
+            w = w / total
+        first[i] = lo
+        weights[i, :hi - lo] = np.floor(0.5 + w * (1 << RESAMPLE_PRECISION_BITS))
+    return first, weights
+
+def round_fixed(acc):
+    # PIL's rounding of accumulated fixed point samples to uint8 values
+    return np.clip(np.floor((acc + (1 << (RESAMPLE_PRECISION_BITS - 1))) / (1 << RESAMPLE_PRECISION_BITS)), 0, 255)
+
+def resample_columns(part, first, weights):
+    # horizontal pass of bilinear_taps over the columns of part (n,w,3), uint8 valued float64 (n,resolution,3)
+    width = part.shape[1]
+    acc = np.zeros((part.shape[0], len(first), part.shape[2]), dtype=np.float64)
+    for k in range(weights.shape[1]):
+        cols = np.minimum(first + k, width - 1)  # taps past the edge have zero weight
+        acc += part[:, cols] * weights[None, :, k, None]
+    return round_fixed(acc)
+
+def reduce_strips(strips, region, resolution):
+    """ Downsamples the region of an image delivered as horizontal strips
+
+    Returns a (resolution, resolution) PIL image, the same pixels as cropping the region
+    and resizing it with Image.BILINEAR as encode() does; only one strip is held at a time.
+    """
+    left, top, right, bottom = region
+    height = bottom - top
+    col_first, col_weights = bilinear_taps(right - left, resolution)
+    row_first, row_weights = bilinear_taps(height, resolution)
+    acc = np.zeros((resolution, resolution * 3), dtype=np.float64)
+    y = 0
+    for strip in strips:
+        n = strip.shape[0]
+        r0, r1 = max(y, top), min(y + n, bottom)
+        if r1 > r0:
+            part = resample_columns(strip[r0-y:r1-y, left:right], col_first, col_weights).reshape(r1 - r0, -1)
+            # (resolution, r1-r0) weights of these rows, integer valued so the float64 sums are exact
+            rows = np.zeros((resolution, r1 - r0), dtype=np.float64)
+            for k in range(row_weights.shape[1]):
+                src = row_first + k - (r0 - top)
+                inside = np.flatnonzero((src >= 0) & (src < r1 - r0))
+                rows[inside, src[inside]] = row_weights[inside, k]
+            acc += rows @ part
+        y += n
+    return Image.fromarray(round_fixed(acc).astype(np.uint8).reshape(resolution, resolution, 3))
+
+def rgb_strip(strip):
+    # uint8 strip (n,w) or (n,w,1|2) greyscale, or (n,w,4) RGBA, as (n,w,3) RGB; alpha is dropped as PIL convert('RGB') does
+    if strip.ndim == 2:
+        strip = strip[:, :, None]
+    if strip.shape[2] < 3:
+        return np.repeat(strip[:, :, :1], 3, axis=2)
+    return strip[:, :, :3]
+
+def open_strips(path):
+    """ Opens an image for strip-wise reading
+
+    Returns (width, height, strips) where strips(rows) starts a new pass over the image,
+    yielding uint8 (n,width,3) RGB strips. .npy files and uncompressed 8-bit TIFF (needs
+    tifffile) are memory mapped and PNG is decoded row by row (needs pypng, pure python so
+    much slower than the memory mapped formats); greyscale and alpha channels are converted
+    strip by strip. Other formats, compressed TIFF and TIFF of other bit depths are loaded
+    whole with PIL.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    pixels = None
+    if ext == '.npy':
+        pixels = np.load(path, mmap_mode='r')
+    elif ext in ['.tif', '.tiff']:
+        import tifffile
+        try:
+            pixels = tifffile.memmap(path, mode='r')
+        except ValueError:
+            pass  # compressed or tiled, not memory-mappable
+    elif ext == '.png':
+        import png
+        width, height, _, info = png.Reader(filename=path).asDirect()
+        alpha = info['alpha']  # palette transparency counts, asRGB8 refuses any alpha
+
+        def strips(rows):
+            reader = png.Reader(filename=path)
+            decoded = reader.asRGBA8() if alpha else reader.asRGB8()
+            batch = []
+            for row in decoded[2]:
+                batch.append(np.frombuffer(row, dtype=np.uint8).reshape(width, -1)[:, :3])
+                if len(batch) == rows:
+                    yield np.stack(batch)
+                    batch = []
+            if batch:
+                yield np.stack(batch)
+        return width, height, strips
+    if pixels is None or (ext != '.npy' and (pixels.dtype != np.uint8 or pixels.ndim == 3 and pixels.shape[2] > 4)):
+        # PIL converts what the strip readers do not handle, planar or 16-bit TIFF among them
+        pixels = np.asarray(Image.open(path).convert('RGB'))
+    height, width = pixels.shape[:2]
+    return width, height, lambda rows: (rgb_strip(pixels[y:y+rows]) for y in range(0, height, rows))
+
+def write_strips(path, width, height, strips):
+    """ Writes horizontal uint8 (n,width,3) strips to path, see open_strips for the formats """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.png':
+        import png
+        with open(path, 'wb') as f:
+            rows = (row.reshape(-1) for strip in strips for row in strip)
+            png.Writer(width, height, greyscale=False, bitdepth=8).write(f, rows)
+        return
+    if ext == '.npy':
+        pixels = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(height, width, 3))
+    elif ext in ['.tif', '.tiff']:
+        import tifffile
+        pixels = tifffile.memmap(path, shape=(height, width, 3), dtype=np.uint8, photometric='rgb')
+    else:
+        pixels = np.empty((height, width, 3), dtype=np.uint8)
+    y = 0
+    for strip in strips:
+        pixels[y:y+strip.shape[0]] = strip
+        y += strip.shape[0]
+    if isinstance(pixels, np.memmap):
+        pixels.flush()
+    else:
+        Image.fromarray(pixels).save(path)
@@ -0,0 +1,39 @@
+# Copyright 2023 Adobe
+# All Rights Reserved.
+
+# NOTICE: Adobe permits you to use, modify, and distribute this file in
+# accordance with the terms of the Adobe license agreement accompanying
+# it.
+
+import torch
+import torch.nn.functional as thf
+
+
+def synthetic_covers(count, resolution, generator=None):
+    # smooth random colour fields plus fine texture, (count,3,res,res) in range [-1, 1]
+    base = torch.rand(count, 3, 8, 8, generator=generator) * 2.0 - 1.0
+    covers = thf.interpolate(base, size=(resolution, resolution), mode='bicubic', align_corners=False)
+    covers = covers + 0.1 * torch.randn(count, 3, resolution, resolution, generator=generator)
+    return covers.clamp(-1, 1)
+
+
+@torch.no_grad()
+def quantize_submodule(model, name, example_inputs, calibration_batches):
+    """ Replaces model.<name> with a statically quantized int8 copy, in place
+
+    The submodule is prepared with FX graph mode quantization for the active
+    quantized engine, calibrated by running the whole model over
+    calibration_batches (tuples of model inputs), then converted.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    parent, _, attr = name.rpartition('.')
+    parent = model.get_submodule(parent) if parent else model
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(getattr(parent, attr), qconfig_mapping, example_inputs)
+    setattr(parent, attr, prepared)
+    for batch in calibration_batches:
+        model(*batch)
+    setattr(parent, attr, convert_fx(prepared))
+    return model
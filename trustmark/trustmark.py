@@ -10,13 +10,15 @@ from __future__ import absolute_import
 import torch
 import os
 import pathlib
-import time
 import importlib
+import threading
+import json
+from copy import deepcopy
 
-from omegaconf import OmegaConf
 from .datalayer import DataLayer
+from .inference import SecretEncoderInference, SecretDecoderInference, WMRemoverInference
+from .merge import feather_ramps, merge_strips, reduce_strips, open_strips, write_strips
 from PIL import Image
-from torchvision import transforms
 import numpy as np
 import urllib.request
 
@@ -25,6 +27,13 @@ import urllib.request
 from hashlib import md5
 from mmap import mmap, ACCESS_READ
 
+# verified checkpoints get a sidecar stamp so later starts can skip rehashing them
+VERIFIED_STAMP_SUFFIX = '.verified'
+VERIFIED_FILES = dict()  # filename -> stamp, files already verified by this process
+
+# frozen artifacts record the MD5 of the checkpoint they were exported from, in this extra file
+FROZEN_CHECKPOINT_FILE = 'checkpoint.md5'
+
 # Content Autenticity Initiative (CAI) Content Delivery Network
 MODEL_REMOTE_HOST = "https://cc-assets.netlify.app/watermarking/trustmark-models/"
 
@@ -66,7 +75,26 @@ MODEL_CHECKSUMS['trustmark_rm_P.ckpt']="8b8f4715ea474327921ee9d0f46d2c3f"
 CONCENTRATE_WM_REGION = 1.0
 ASPECT_RATIO_LIM = 2.0
 FALLBACK_ALL_SCHEMAS = True
+FALLBACK_SCHEMAS = (0, 1, 2)  # schemas tried on reads that fail to decode, not bch_3 whose weak code would accept too much noise
+SOFT_DECODE_BITS = 6  # least reliable bits tried by soft decision decoding of failed reads, 0 to disable
 FEATHERING_RESIDUAL=0.01
+ENCODE_BATCH_SIZE=8
+MERGE_STRIP_PIXELS=1<<20  # pixels per strip when merging residuals, bounds the float32 working set
+DECODER_RESOLUTION=224  # input size of the decoder backbone, SecretDecoder downsamples anything larger to it
+DECODE_BATCH_SIZE=32  # images per decoder forward, also the largest input buffer kept per thread (about 19MB)
+MODEL_COMPONENTS=('decoder', 'encoder', 'remover')
+INT8_COMPONENTS=('decoder',)
+INT8_CALIBRATION_IMAGES=16
+INT8_CALIBRATION_BATCH=8
+CONFIDENCE_TEMPERATURE=1.0  # decoder logits are divided by this before being read as log odds; 1.0, uncalibrated, unless
+                            # scripts/calibrate_confidence.py has fitted a temperature for the model (models/confidence_<type>.json)
+# test time augmented views for decode(tta=...), (scale, dx, dy) of a crop of the processing region, the shifts as fractions
+# of its size; most different first, so that reading a few of them covers shifts and scale
+TTA_VIEWS=((1.0, 0.0, 0.0), (0.9, -0.05, -0.05), (0.9, 0.05, 0.05), (0.8, 0.0, 0.0), (0.9, 0.05, -0.05), (0.9, -0.05, 0.05), (0.9, 0.0, 0.0))
+HOPELESS_BITFLIPS_RATIO=3.0  # reads expecting more than this many times the correctable bitflips are not worth retrying
+
+# inference networks defined next to lightning training code, mapped to their lightning-free home
+INFERENCE_TARGETS={'trustmark.denoise.SimpleUnet': 'trustmark.unet.SimpleUnet'}
 
 class TrustMark():
 
@@ -77,7 +105,7 @@ class TrustMark():
        BCH_4=2
        BCH_5=1
 
-    def __init__(self, use_ECC=True, verbose=True, secret_len=100, device='', model_type='Q', encoding_type=Encoding.BCH_5, concentrate_wm_region=CONCENTRATE_WM_REGION):
+    def __init__(self, use_ECC=True, verbose=True, secret_len=100, device='', model_type='Q', encoding_type=Encoding.BCH_5, concentrate_wm_region=CONCENTRATE_WM_REGION, components=MODEL_COMPONENTS, reverify=False, use_frozen=True, precision='fp32', int8_components=INT8_COMPONENTS, cpu_threads=0, channels_last=False):
         """ Initializes the TrustMark watermark encoder/decoder/remover module
 
         Parameters (default listed first)
@@ -89,6 +117,32 @@ class TrustMark():
         verbose : bool
             [True] will output status messages during use (default)
             [False] will run silent except for error messages
+        components : tuple
+            [('decoder', 'encoder', 'remover')] models loaded up front (default)
+            any subset, e.g. ('decoder',) for scan-only workers; models not listed
+            are loaded lazily the first time they are used
+        reverify : bool
+            [False] trusts the .verified stamp of model files that have not changed since their last MD5 check (default)
+            [True] recomputes the MD5 of every model file before loading it
+        use_frozen : bool
+            [True] loads the frozen TorchScript artifacts written by export_frozen when present and exported
+            from the current checkpoint (default), stale artifacts are ignored
+            [False] always builds the models from their yaml config and checkpoint
+        precision : str
+            ['fp32'] runs every model in float32 (default)
+            ['int8'] runs int8_components statically quantized for CPU inference, from the int8 artifacts
+            exported offline by scripts/export_frozen.py --precision int8; with use_frozen=False they are
+            quantized in process instead, calibrated on synthetic images watermarked by the float encoder (slow)
+        int8_components : tuple
+            [('decoder',)] models quantized when precision is 'int8' (default)
+            ('decoder', 'encoder') also quantizes the encoder Unet, at some cost to PSNR
+        cpu_threads : int
+            [0] leaves the torch thread pools untouched (default)
+            N sets the intra-op threads to N and the inter-op threads to 1, e.g. cpu_thread_budget(workers)
+            so several server workers on one host do not oversubscribe its cores
+        channels_last : bool
+            [False] runs the models on NCHW tensors (default)
+            [True] converts the models and their inputs to channels_last, usually faster on CPU
         """
 
         super(TrustMark, self).__init__()
@@ -104,13 +158,32 @@ class TrustMark():
         # the location of three models
         assert model_type in ['C', 'Q', 'B', 'P']
         self.model_type = model_type
-
-
-        locations={'config' : os.path.join(pathlib.Path(__file__).parent.resolve(),f'models/trustmark_{self.model_type}.yaml'), 
-                   'config-rm' : os.path.join(pathlib.Path(__file__).parent.resolve(),f'models/trustmark_rm_{self.model_type}.yaml'), 
-                   'decoder': os.path.join(pathlib.Path(__file__).parent.resolve(),f'models/decoder_{self.model_type}.ckpt'), 
-                   'remover': os.path.join(pathlib.Path(__file__).parent.resolve(),f'models/trustmark_rm_{self.model_type}.ckpt'),
-                   'encoder': os.path.join(pathlib.Path(__file__).parent.resolve(),f'models/encoder_{self.model_type}.ckpt')}
+        self.reverify = reverify
+        self.use_frozen = use_frozen
+
+        assert precision in ['fp32', 'int8']
+        self.precision = precision
+        if precision == 'int8':
+            assert torch.device(self.device).type == 'cpu', 'int8 precision is only supported on cpu'
+            assert all(part in ['decoder', 'encoder'] for part in int8_components)
+            self.int8_components = tuple(int8_components)
+        else:
+            self.int8_components = ()
+
+        self.channels_last = channels_last
+        if cpu_threads and torch.device(self.device).type == 'cpu':
+            configure_cpu_threads(cpu_threads)
+
+        self.locations={'config' : os.path.join(pathlib.Path(__file__).parent.resolve(),f'models/trustmark_{self.model_type}.yaml'), 
+                        'config-rm' : os.path.join(pathlib.Path(__file__).parent.resolve(),f'models/trustmark_rm_{self.model_type}.yaml'), 
+                        'decoder': os.path.join(pathlib.Path(__file__).parent.resolve(),f'models/decoder_{self.model_type}.ckpt'), 
+                        'remover': os.path.join(pathlib.Path(__file__).parent.resolve(),f'models/trustmark_rm_{self.model_type}.ckpt'),
+                        'encoder': os.path.join(pathlib.Path(__file__).parent.resolve(),f'models/encoder_{self.model_type}.ckpt'),
+                        'calibration': os.path.join(pathlib.Path(__file__).parent.resolve(),f'models/confidence_{self.model_type}.json')}
+        for part in MODEL_COMPONENTS:
+            # frozen artifacts are specific to the device type (and precision) they were exported on
+            suffix = '.int8.pt' if part in self.int8_components else '.pt'
+            self.locations[part+'-frozen'] = self.locations[part].replace('.ckpt', '.%s%s' % (torch.device(self.device).type, suffix))
 
         self.use_ECC = use_ECC
         self.secret_len = secret_len
@@ -127,10 +200,55 @@ class TrustMark():
            self.model_resolution_enc = 256
            self.model_resolution_dec = 245
         self.model_resolution_remove = 256
-        
-        self.decoder = self.load_model(locations['config'], locations['decoder'], self.device, secret_len, part='decoder')
-        self.encoder = self.load_model(locations['config'], locations['encoder'], self.device, secret_len, part='encoder')
-        self.removal = self.load_model(locations['config-rm'], locations['remover'], self.device, secret_len, part='remover')
+        # decode inputs are resized once, straight to what the decoder backbone consumes
+        self.decoder_resolution = min(self.model_resolution_dec, DECODER_RESOLUTION)
+        self.buffers = threading.local()  # per-thread reusable input tensors
+        self.confidence_temperature = load_confidence_temperature(self.locations['calibration'])
+
+        self.models = dict()
+        self.configs = dict()
+        self.model_lock = threading.Lock()
+        for part in components:
+            assert part in MODEL_COMPONENTS
+            self.get_model(part)
+
+    @property
+    def decoder(self):
+        return self.get_model('decoder')
+
+    @property
+    def encoder(self):
+        return self.get_model('encoder')
+
+    @property
+    def removal(self):
+        return self.get_model('remover')
+
+    def get_model(self, part):
+        # loads each model the first time it is needed
+        model = self.models.get(part)
+        if model is None:
+            with self.model_lock:
+                if part not in self.models:
+                    frozen = None
+                    if self.use_frozen and os.path.isfile(self.locations[part+'-frozen']):
+                        frozen = self.load_frozen_model(self.locations[part+'-frozen'], self.device, part=part,
+                                                        checkpoint_md5=checkpoint_digest(self.locations[part], reverify=self.reverify))
+                    if frozen is not None:
+                        self.models[part] = frozen
+                    elif self.use_frozen and part in self.int8_components:
+                        # calibration needs the float encoder and takes tens of seconds, it is done offline
+                        raise FileNotFoundError('no int8 artifact %s for the current checkpoint, export it with scripts/export_frozen.py --precision int8' % self.locations[part+'-frozen'])
+                    else:
+                        config = self.locations['config-rm'] if part == 'remover' else self.locations['config']
+                        model = self.load_model(config, self.locations[part], self.device, self.secret_len, part=part)
+                        if part in self.int8_components:
+                            model = self.quantize_model(model, part)
+                        if self.channels_last:
+                            model = model.to(memory_format=torch.channels_last)
+                        self.models[part] = model
+                model = self.models[part]
+        return model
 
 
     def schemaCapacity(self):
@@ -140,39 +258,44 @@ class TrustMark():
             return self.secret_len
 
     def check_and_download(self, filename):
-        valid=False
-        if os.path.isfile(filename) and os.path.getsize(filename)>0:
-            with open(filename) as file, mmap(file.fileno(), 0, access=ACCESS_READ) as file:
-                 valid= (MODEL_CHECKSUMS[pathlib.Path(filename).name]==md5(file).hexdigest())
+        valid = verify_model_file(filename, reverify=self.reverify)
 
         if not valid:
             print('Fetching model file (once only): '+filename)
             urld=MODEL_REMOTE_HOST+os.path.basename(filename)
  
             urllib.request.urlretrieve(urld, filename=filename)
+            if not verify_model_file(filename, reverify=True):
+                print('Warning: checksum mismatch for downloaded model file: '+filename)
+
+    def load_config(self, config_path):
+        # parse each yaml once, hand out a copy that can be patched per part
+        if config_path not in self.configs:
+            from omegaconf import OmegaConf  # only the checkpoint path needs the yaml configs
+            self.check_and_download(config_path)
+            self.configs[config_path] = OmegaConf.load(config_path).model
+        return deepcopy(self.configs[config_path])
 
     def load_model(self, config_path, weight_path, device, secret_len, part='all'):
         assert part in ['all', 'encoder', 'decoder', 'remover']
-        self.check_and_download(config_path)
+        config = self.load_config(config_path)
         self.check_and_download(weight_path)
-        config = OmegaConf.load(config_path).model
         if part == 'encoder':
-            # replace all other components with identity
-            config.params.secret_decoder_config.target = 'trustmark.model.Identity'
-            config.params.discriminator_config.target = 'trustmark.model.Identity'
-            config.params.loss_config.target = 'trustmark.model.Identity'
-            config.params.noise_config.target = 'trustmark.model.Identity'
+            # build the inference network only, as TrustMark_Arch would configure it
+            encoder_config = config.params.secret_encoder_config
+            encoder_config.params.secret_len = config.params.secret_len
+            encoder_config.params.resolution = config.params.resolution
+            model = SecretEncoderInference(instantiate_from_config(encoder_config, INFERENCE_TARGETS))
         elif part == 'decoder':
-            # replace all other components with identity
-            config.params.secret_encoder_config.target = 'trustmark.model.Identity'
-            config.params.discriminator_config.target = 'trustmark.model.Identity'
-            config.params.loss_config.target = 'trustmark.model.Identity'
-            config.params.noise_config.target = 'trustmark.model.Identity'
-
+            decoder_config = config.params.secret_decoder_config
+            decoder_config.params.secret_len = config.params.secret_len
+            decoder_config.params.resolution = DECODER_RESOLUTION
+            model = SecretDecoderInference(instantiate_from_config(decoder_config, INFERENCE_TARGETS))
         elif part == 'remover':
-            config.params.is_train = False  # inference mode, only load denoise module
-    
-        model = instantiate_from_config(config)
+            model = WMRemoverInference(instantiate_from_config(config.params.denoise_config, INFERENCE_TARGETS))
+        else:
+            model = instantiate_from_config(config)  # full training architecture, needs lightning
+
         state_dict = torch.load(weight_path, map_location=torch.device('cpu'))
         
         if 'global_step' in state_dict:
@@ -180,105 +303,141 @@ class TrustMark():
         if 'state_dict' in state_dict:
             state_dict = state_dict['state_dict']
             
+        # the inference networks keep the attribute names of the training wrappers, so checkpoint keys line up
         misses, ignores = model.load_state_dict(state_dict, strict=False)
         model = model.to(device)
         model.eval()
 
         return model
 
-    def get_the_image_for_processing(self, in_image):
+    def quantize_model(self, model, part):
+        # static int8 quantization of the backbone, calibrated on synthetic covers watermarked with random payloads
+        from .quantization import synthetic_covers, quantize_submodule
+        generator = torch.Generator().manual_seed(0)
+        rng = np.random.RandomState(0)
+        covers = synthetic_covers(INT8_CALIBRATION_IMAGES, self.model_resolution_enc, generator)
+        bits = [''.join(str(b) for b in rng.randint(0, 2, self.schemaCapacity())) for _ in range(INT8_CALIBRATION_IMAGES)]
+        secrets = torch.from_numpy(self.encode_secrets(bits, MODE='binary')).float()
+        batches = [(covers[i:i+INT8_CALIBRATION_BATCH], secrets[i:i+INT8_CALIBRATION_BATCH])
+                   for i in range(0, INT8_CALIBRATION_IMAGES, INT8_CALIBRATION_BATCH)]
+        if part == 'encoder':
+            example = (covers[:1], secrets[:1])
+            return quantize_submodule(model, 'encoder', example, batches)
+
+        # the decoder is calibrated on stego images from the float encoder, plus the clean covers
+        encoder = self.models.get('encoder')
+        if encoder is None or 'encoder' in self.int8_components:
+            encoder = self.load_model(self.locations['config'], self.locations['encoder'], self.device, self.secret_len, part='encoder')
+        stegos = []
+        with torch.no_grad():
+            for cover, secret in batches:
+                stego, _ = encoder(cover, secret)
+                for image in (stego.clamp(-1, 1), cover):
+                    image = torch.nn.functional.interpolate(image, size=(self.decoder_resolution, self.decoder_resolution), mode='area')
+                    stegos.append((image,))
+        example = (torch.zeros(1, 3, self.decoder_resolution, self.decoder_resolution),)
+        return quantize_submodule(model, 'decoder.decoder', example, stegos)
+
+    def load_frozen_model(self, frozen_path, device, part, checkpoint_md5=None):
+        # TorchScript artifacts skip config instantiation and checkpoint loading entirely
+        # returns None when the artifact was not exported from the checkpoint with checkpoint_md5
+        assert part in MODEL_COMPONENTS
+        source = {FROZEN_CHECKPOINT_FILE: ''}
+        model = torch.jit.load(frozen_path, map_location=device, _extra_files=source)
+        if checkpoint_md5 is not None and source[FROZEN_CHECKPOINT_FILE].decode() != checkpoint_md5:
+            print('Warning: ignoring frozen artifact exported from another checkpoint: '+frozen_path)
+            return None
+        try:
+            # conv/bn folding and oneDNN fusion, done after loading since the fused graph does not serialize
+            model = torch.jit.optimize_for_inference(model)
+        except Exception:
+            model = torch.jit.load(frozen_path, map_location=device)
+        model.eval()
+        return model
+
+    @torch.no_grad()
+    def export_frozen(self, components=MODEL_COMPONENTS):
+        """ Writes frozen TorchScript artifacts of the inference networks next to the checkpoints
+
+        Later TrustMark instances on the same device type load these instead of the
+        yaml config and checkpoint, as long as the checkpoint's MD5 still matches the one
+        recorded in the artifact. Returns the list of files written.
+        """
+        written = []
+        for part in components:
+            module = self.get_model(part)
+            if part == 'decoder':
+                example = (torch.zeros(1, 3, self.decoder_resolution, self.decoder_resolution, device=self.device),)
+            elif part == 'encoder':
+                example = (torch.zeros(1, 3, self.model_resolution_enc, self.model_resolution_enc, device=self.device),
+                           torch.zeros(1, self.secret_len, device=self.device))
+            else:
+                example = (torch.zeros(1, 3, self.model_resolution_remove, self.model_resolution_remove, device=self.device),)
+            path = self.locations[part+'-frozen']
+            if not isinstance(module, torch.jit.ScriptModule):  # otherwise already loaded from this artifact
+                source = {FROZEN_CHECKPOINT_FILE: checkpoint_digest(self.locations[part], reverify=self.reverify)}
+                torch.jit.save(torch.jit.freeze(torch.jit.trace(module, example)), path, _extra_files=source)
+            written.append(path)
+        return written
+
+    def processing_region(self, width, height):
+        # (left, top, right, bottom) of the region the watermark is applied to / read from
         scale=self.concentrate_wm_region
-        width, height = in_image.size
-        
+
         # Compute aspect ratio (≥ 1.0)
         if width > height:
             aspect_ratio = width / height
         else:
             aspect_ratio = height / width
-        
-        # Make a copy of the image (PIL)
-        out_im = in_image.copy()
 
         if (aspect_ratio > self.aspect_ratio_lim):
             # We do a center-square approach, but scaled
             square_size = min(width, height)  # largest possible square dimension
-            scaled_size = int(square_size * scale)  # scale that dimension
-
-            # Compute bounding box
-            left   = (width  - scaled_size) // 2
-            top    = (height - scaled_size) // 2
-            right  = left + scaled_size
-            bottom = top  + scaled_size
-            
-            out_im = out_im.crop((left, top, right, bottom))
-        
+            scaled_w = scaled_h = int(square_size * scale)  # scale that dimension
         else:
             # The aspect ratio is normal, so we consider
             # the *entire* image dimension. Then scale that region
             scaled_w = int(width  * scale)
             scaled_h = int(height * scale)
-            
-            # Center the smaller (or bigger) rectangle
-            left   = (width  - scaled_w) // 2
-            top    = (height - scaled_h) // 2
-            right  = left + scaled_w
-            bottom = top  + scaled_h
-            
-            out_im = out_im.crop((left, top, right, bottom))
-
-        return out_im
-
-
-    def put_the_image_after_processing(self, wm_image, cover_im, feather=True):
 
-        scale = self.concentrate_wm_region
-        cover_h, cover_w, _ = cover_im.shape
-
-        if cover_w > cover_h:
-            aspect_ratio = cover_w / cover_h
-        else:
-            aspect_ratio = cover_h / cover_w
+        # Center the smaller (or bigger) rectangle
+        left   = (width  - scaled_w) // 2
+        top    = (height - scaled_h) // 2
+        right  = left + scaled_w
+        bottom = top  + scaled_h
+        return left, top, right, bottom
 
-        out_im = cover_im.copy()
+    def get_the_image_for_processing(self, in_image):
+        box = self.processing_region(*in_image.size)
+        if box == (0, 0) + in_image.size:
+            return in_image  # whole image, no need for a copy
+        return in_image.crop(box)
 
-        if (aspect_ratio > self.aspect_ratio_lim):
-            # Square region, scaled
-            square_size = min(cover_w, cover_h)
-            scaled_size = int(square_size * scale)
+    def feather_size(self, region):
+        # width of the blended border when pasting the watermarked region back into the cover
+        left, top, right, bottom = region
+        feather_size = int(min(right - left, bottom - top) * FEATHERING_RESIDUAL)
+        feather_size = max(1, feather_size)
+        return min(feather_size, 50)
 
-            left   = (cover_w - scaled_size) // 2
-            top    = (cover_h - scaled_size) // 2
-            right  = left + scaled_size
-            bottom = top  + scaled_size
+    def strip_rows(self, width):
+        # rows per strip when merging a residual into an image of this width
+        return max(1, MERGE_STRIP_PIXELS // width)
 
-            region_w = scaled_size
-            region_h = scaled_size
 
-        else:
-            # Normal ratio, scaled
-            scaled_w = int(cover_w * scale)
-            scaled_h = int(cover_h * scale)
-            left   = (cover_w - scaled_w) // 2
-            top    = (cover_h - scaled_h) // 2
-            right  = left + scaled_w
-            bottom = top  + scaled_h
+    def put_the_image_after_processing(self, wm_image, cover_im, feather=True):
 
-            region_w = scaled_w
-            region_h = scaled_h
+        cover_h, cover_w, _ = cover_im.shape
+        left, top, right, bottom = self.processing_region(cover_w, cover_h)
+        out_im = cover_im.copy()
 
         if feather:
-
-            feather_size = int(min(region_w, region_h) * FEATHERING_RESIDUAL)
-        
-            feather_size = max(1, feather_size)      
-            feather_size = min(feather_size, 50)
-
             self.feather_paste(
                 out_im,       # destination (modified in-place)
                 cover_im,     # original for reference
                 wm_image,     # watermark patch
                 top, bottom, left, right,
-                feather_size=feather_size
+                feather_size=self.feather_size((left, top, right, bottom))
             )
         else:
             out_im[top:bottom, left:right, :] = wm_image
@@ -292,150 +451,537 @@ class TrustMark():
         top: int, bottom: int,
         left: int, right: int,
         feather_size: int = 9):
-    
+
         out_im[top:bottom, left:right, :] = wm_image
-        alpha_vals = [ (i+1) / feather_size for i in range(feather_size) ]
-    
-        feather_size = min(feather_size, (bottom - top), (right - left))
-    
-        for i in range(feather_size):
-            alpha = alpha_vals[i]
-            row = top + i
-            # Blend that entire row from left..right
-            out_im[row, left:right, :] = (
-                alpha * wm_image[i, :, :] +
-                (1.0 - alpha) * cover_im[row, left:right, :]
+        height, width = bottom - top, right - left
+        alpha_rows, row_band, alpha_cols, col_band = feather_ramps(height, width, feather_size)
+
+        # top and bottom bands across the full width, the column ramp takes precedence in the corners
+        rows = np.flatnonzero(row_band)
+        alpha = np.where(col_band[None, :], alpha_cols[None, :], alpha_rows[rows, None])[:, :, None]
+        out_im[top + rows, left:right, :] = (
+            alpha * wm_image[rows] +
+            (1.0 - alpha) * cover_im[top + rows, left:right, :]
+        )
+
+        # left and right bands over the rows in between
+        rows, cols = np.flatnonzero(~row_band), np.flatnonzero(col_band)
+        if len(rows) and len(cols):
+            alpha = alpha_cols[cols][None, :, None]
+            out_im[np.ix_(top + rows, left + cols)] = (
+                alpha * wm_image[np.ix_(rows, cols)] +
+                (1.0 - alpha) * cover_im[np.ix_(top + rows, left + cols)]
             )
-        
-        for i in range(feather_size):
-            alpha = alpha_vals[i]
-            row = bottom - 1 - i
-            wm_row = (bottom - top - 1) - i
-            out_im[row, left:right, :] = (
-                alpha * wm_image[wm_row, :, :] +
-                (1.0 - alpha) * cover_im[row, left:right, :]
-            )
-    
-        for i in range(feather_size):
-            alpha = alpha_vals[i]
-            col = left + i
-            out_im[top:bottom, col, :] = (
-                alpha * wm_image[:, i, :] +
-                (1.0 - alpha) * cover_im[top:bottom, col, :]
-            )
-    
-        for i in range(feather_size):
-            alpha = alpha_vals[i]
-            col = right - 1 - i
-            wm_col = (right - left - 1) - i
-            out_im[top:bottom, col, :] = (
-                alpha * wm_image[:, wm_col, :] +
-                (1.0 - alpha) * cover_im[top:bottom, col, :]
-            )
-    
 
+    def to_model_input(self, tensor):
+        # (B,3,H,W) image tensor on the model device, in the memory format of the models
+        tensor = tensor.to(self.device)
+        if self.channels_last:
+            tensor = tensor.contiguous(memory_format=torch.channels_last)
+        return tensor
+
+    def decode_buffer(self, count):
+        # reusable decoder input (count,3,res,res) of the calling thread, grown up to DECODE_BATCH_SIZE images;
+        # larger requests get a fresh tensor so one big batch does not pin its memory for the life of the thread
+        buffer = getattr(self.buffers, 'decode', None)
+        if buffer is None or buffer.shape[0] < count:
+            with torch.inference_mode(False):  # a normal tensor, so it can be refilled in or out of inference mode
+                buffer = torch.empty(count, 3, self.decoder_resolution, self.decoder_resolution, device=self.device)
+                if self.channels_last:
+                    buffer = buffer.contiguous(memory_format=torch.channels_last)
+            if count <= DECODE_BATCH_SIZE:
+                self.buffers.decode = buffer
+        return buffer[:count]
+
+    def preprocess_for_decode(self, in_stego_image, out=None, box=None):
+        # Inputs
+        #   in_stego_image: PIL image, or numpy uint8 array as read by cv2: (h,w,3) BGR, (h,w) greyscale or (h,w,4) BGRA
+        #   out: optional (3,res,res) tensor to write the result into
+        #   box: optional (left, top, right, bottom) to read instead of the processing region
+        # Outputs: decoder input tensor (1,3,res,res) in range [-1, 1]
+        # The processing region is resized once, straight to the decoder resolution, with area
+        # interpolation when shrinking; no full size copy or crop of the input is made
+        res = self.decoder_resolution
+        if isinstance(in_stego_image, np.ndarray):
+            import cv2  # callers holding cv2 arrays have it installed
+            # no scaling is guessed for other types, float images in [0, 1] would otherwise decode as noise
+            assert in_stego_image.dtype == np.uint8, 'numpy images must be uint8 (0-255), not %s' % in_stego_image.dtype
+            height, width = in_stego_image.shape[:2]
+            left, top, right, bottom = box or self.processing_region(width, height)
+            shrink = min(right - left, bottom - top) >= res
+            pixels = cv2.resize(in_stego_image[top:bottom, left:right], (res, res),
+                                interpolation=cv2.INTER_AREA if shrink else cv2.INTER_LINEAR)
+            # to 3 channels once resized, resizing works per channel so this matches converting first without a full size copy
+            if pixels.ndim == 2 or pixels.shape[2] == 1:
+                pixels = cv2.cvtColor(pixels, cv2.COLOR_GRAY2BGR)
+            elif pixels.shape[2] == 4:
+                pixels = cv2.cvtColor(pixels, cv2.COLOR_BGRA2BGR)
+            pixels = torch.from_numpy(pixels).flip(-1)  # BGR -> RGB
+        else:
+            if in_stego_image.mode != 'RGB':
+                in_stego_image = in_stego_image.convert('RGB')
+            box = box or self.processing_region(*in_stego_image.size)
+            shrink = min(box[2] - box[0], box[3] - box[1]) >= res
+            pixels = in_stego_image.resize((res, res), Image.BOX if shrink else Image.BILINEAR, box=box)
+            pixels = torch.from_numpy(np.array(pixels))
+        if out is None:
+            out = self.decode_buffer(1)[0]
+        out.copy_(pixels.permute(2, 0, 1))  # (3,res,res), uint8 -> float
+        out.mul_(2.0 / 255).sub_(1.0)
+        return out.unsqueeze(0)
+
+    def decode(self, in_stego_image, MODE='text', tta=0, tta_start=0):
+        # Inputs
+        # stego_image: PIL image or cv2 BGR array
+        # tta: number of TTA_VIEWS to read, True for all; the views are decoded as one batch and the best ECC valid read is returned
+        # tta_start: index of the first TTA_VIEWS view read, 1 skips the plain view when a plain decode already failed
+        # Outputs: (secret, detected, version)
+        if tta:
+            result = self.decode_detailed(in_stego_image, MODE, tta, tta_start)
+            return result['secret'], result['detected'], result['version']
+        return self.decode_batch([in_stego_image], MODE)[0]
+
+    def decode_batch(self, in_stego_images, MODE='text'):
+        # Inputs
+        # in_stego_images: list of PIL images or cv2 BGR arrays
+        # Outputs: list of (secret, detected, version), one per image, from a single decoder forward
+        if len(in_stego_images)==0:
+            return []
+        logits = self.decoder_logits(in_stego_images)
+        return [result[:3] for result in self.decode_secret_bits_detail(logits > 0, MODE, logits)]
+
+    def decoder_logits(self, in_stego_images, boxes=None):
+        # Inputs
+        #   boxes: optional (left, top, right, bottom) per image to read instead of its processing region
+        # Outputs: raw decoder outputs, float32 numpy array (N, secret_len), a bit is set where its logit is positive
+        # Images are run DECODE_BATCH_SIZE at a time through the thread's input buffer
+        logits = []
+        for start in range(0, len(in_stego_images), DECODE_BATCH_SIZE):
+            chunk = in_stego_images[start:start+DECODE_BATCH_SIZE]
+            stego = self.decode_buffer(len(chunk))  # (n,3,res,res)
+            for i, im in enumerate(chunk):
+                self.preprocess_for_decode(im, out=stego[i], box=boxes[start+i] if boxes else None)
+            with torch.inference_mode():
+                logits.append(self.decoder(stego).float().cpu().numpy())
+        return np.concatenate(logits) if logits else np.zeros((0, self.secret_len), dtype=np.float32)
+
+    def tta_boxes(self, width, height, count, start=0):
+        # (left, top, right, bottom) of count TTA_VIEWS from start on of a width x height image, kept inside its processing region
+        left, top, right, bottom = self.processing_region(width, height)
+        w, h = right - left, bottom - top
+        boxes = []
+        for scale, dx, dy in TTA_VIEWS[start:start+count]:
+            cw, ch = max(1, round(w * scale)), max(1, round(h * scale))
+            x0 = min(max(left + (w - cw) // 2 + round(dx * w), left), right - cw)
+            y0 = min(max(top + (h - ch) // 2 + round(dy * h), top), bottom - ch)
+            boxes.append((x0, y0, x0 + cw, y0 + ch))
+        return boxes
+
+    def decode_detailed(self, in_stego_image, MODE='text', tta=0, tta_start=0):
+        # Inputs
+        # stego_image: PIL image or cv2 BGR array
+        # tta, tta_start: as for decode
+        # Outputs: dict, see decode_batch_detailed; with tta, that of the detected view with the highest
+        #   confidence, or when none decodes, of the view expecting the fewest bitflips
+        if not tta:
+            return self.decode_batch_detailed([in_stego_image], MODE)[0]
+        if isinstance(in_stego_image, np.ndarray):
+            height, width = in_stego_image.shape[:2]
+        else:
+            width, height = in_stego_image.size
+        boxes = self.tta_boxes(width, height, len(TTA_VIEWS) if tta is True else tta, tta_start)
+        assert boxes, 'tta_start %d leaves no TTA_VIEWS to read' % tta_start
+        results = self.detailed_results(self.decoder_logits([in_stego_image] * len(boxes), boxes), MODE)
+        return max(results, key=lambda r: (r['detected'], r['confidence'], -r['expected_bitflips']))
+
+    def decode_batch_detailed(self, in_stego_images, MODE='text'):
+        # Inputs
+        # in_stego_images: list of PIL images or cv2 BGR arrays
+        # Outputs: list of dicts, one per image, plain Python values so they serialize to JSON as they are
+        #   secret, detected, version: as returned by decode
+        #   logits: raw decoder outputs, list of secret_len floats, a bit is set where its logit is positive
+        #   margins: |logits|, how far each bit is from flipping
+        #   bitflips: bit errors corrected by the BCH code, -1 when nothing was decoded
+        #   expected_bitflips: bit errors expected in the ECC protected bits, reading the logits as log odds
+        #   confidence: probability, from the margins, that the read is within reach of the code; 0 when nothing was decoded.
+        #     Calibrated only once scripts/calibrate_confidence.py has fitted the temperature of the model
+        #   hopeless: the read is so far beyond what the code corrects that retrying it is pointless
+        if len(in_stego_images)==0:
+            return []
+        return self.detailed_results(self.decoder_logits(in_stego_images), MODE)
+
+    def detailed_results(self, logits, MODE='text'):
+        # decode_batch_detailed dicts of the decoder outputs logits (N, secret_len)
+        results = []
+        for row, (secret, detected, version, bitflips) in zip(logits, self.decode_secret_bits_detail(logits > 0, MODE, logits)):
+            error_probs, correctable = self.read_errors(row, version if detected else self.enctyp)
+            expected_bitflips = float(error_probs.sum())
+            results.append({
+                'secret': secret,
+                'detected': bool(detected),
+                'version': int(version),
+                'logits': row.tolist(),
+                'margins': np.abs(row).tolist(),
+                'bitflips': int(bitflips),
+                'expected_bitflips': expected_bitflips,
+                'confidence': within_correctable(error_probs, correctable) if detected else 0.0,
+                'hopeless': bool(not detected and self.hopeless_read(row, self.enctyp)),
+            })
+        return results
+
+    def read_errors(self, logits, version):
+        # Inputs
+        #   logits: decoder outputs of one image (secret_len,)
+        #   version: schema the read is decoded with
+        # Outputs: (error probabilities of the ECC protected bits, bitflips the schema corrects)
+        if not self.use_ECC:
+            return bit_error_probabilities(logits, self.confidence_temperature), 0
+        # data and ecc bits, the version bits that follow are not protected
+        protected = self.ecc.payload_len - self.ecc.versionbits
+        return bit_error_probabilities(logits[:protected], self.confidence_temperature), self.ecc.schemaCorrectable(version)
+
+    def hopeless_read(self, logits, version):
+        # True when the read expects so many more bitflips than the schema corrects that retrying it is pointless
+        error_probs, correctable = self.read_errors(logits, version)
+        return error_probs.sum() > HOPELESS_BITFLIPS_RATIO * max(correctable, 1)
 
-    def decode(self, in_stego_image, MODE='text'):
+    def decode_secret_bits(self, secret_binaryarray, MODE='text'):
         # Inputs
-        # stego_image: PIL image
-        # Outputs: secret numpy array (1, secret_len)
-        stego_image = self.get_the_image_for_processing(in_stego_image)
-        stego_image = stego_image.resize((self.model_resolution_dec,self.model_resolution_dec), Image.BILINEAR)
-        stego = transforms.ToTensor()(stego_image).unsqueeze(0).to(self.decoder.device) * 2.0 - 1.0 # (1,3,modelres,modelres) in range [-1, 1]
-        with torch.no_grad():
-            secret_binaryarray = (self.decoder.decoder(stego) > 0).cpu().numpy()  # (1, secret_len)
-        if self.use_ECC:
-            secret_pred, detected, version = self.ecc.decode_bitstream(secret_binaryarray, MODE)[0]
-            if not detected and FALLBACK_ALL_SCHEMAS:
-                # last ditch attempt to recover a possible corruption of the version bits by trying all other schema types
-                modeset= [x for x in range(0,3) if x not in [version]] # not bch_3   
-                for m in modeset:
-                     if m==0:
-                        secret_binaryarray[0][-2]=False
-                        secret_binaryarray[0][-1]=False
-                     if m==1:
-                        secret_binaryarray[0][-2]=False
-                        secret_binaryarray[0][-1]=True
-                     if m==2:
-                        secret_binaryarray[0][-2]=True
-                        secret_binaryarray[0][-1]=False
-                     if m==3: 
-                        secret_binaryarray[0][-2]=True  
-                        secret_binaryarray[0][-1]=True
-                     secret_pred, detected, version = self.ecc.decode_bitstream(secret_binaryarray, MODE)[0]
-                     if (detected):
-                          return secret_pred, detected, version   
-                     else:
-                          return '', False, -1
-            else:
-                return secret_pred, detected, version
+        # secret_binaryarray: thresholded decoder output, bool numpy array (N, secret_len)
+        # Outputs: list of (secret, detected, version), one per row
+        return [result[:3] for result in self.decode_secret_bits_detail(secret_binaryarray, MODE)]
+
+    def decode_secret_bits_detail(self, secret_binaryarray, MODE='text', logits=None):
+        # as decode_secret_bits, with the corrected bitflips (-1 if not decoded) as a fourth value
+        # given the logits the bits were thresholded from, failed reads within reach of the code are soft decoded
+        assert len(secret_binaryarray.shape)==2
+        if not self.use_ECC:
+            return [(''.join(str(int(x)) for x in row), True, -1, 0) for row in secret_binaryarray]
+        results = self.ecc.decode_bitstream_detail(secret_binaryarray, MODE)
+        if logits is not None and SOFT_DECODE_BITS:
+            for i, (secret_pred, detected, version, bitflips) in enumerate(results):
+                if not detected and not self.hopeless_read(logits[i], version):
+                    results[i] = self.ecc.chase_decode(logits[i], MODE, SOFT_DECODE_BITS)
+        if FALLBACK_ALL_SCHEMAS:
+            for i, (secret_pred, detected, version, bitflips) in enumerate(results):
+                if not detected:
+                    results[i] = self.decode_fallback_schemas(secret_binaryarray[i:i+1], version, MODE)
+        return results
+
+    def decode_fallback_schemas(self, secret_binaryarray, version, MODE='text'):
+        # last ditch attempt to recover a possible corruption of the version bits by trying all other schema types
+        # Inputs
+        #   secret_binaryarray: bool numpy array (1, secret_len) that failed to decode, left untouched
+        #   version: schema its version bits name
+        # Outputs: (secret, detected, version, bitflips), ('', False, -1, -1) when no schema decodes it
+        schemas = [x for x in FALLBACK_SCHEMAS if x != version]
+        secret_pred, detected, version, bitflips = self.ecc.decode_all_schemas(secret_binaryarray, MODE, schemas)[0]
+        if detected:
+            return secret_pred, detected, version, bitflips
+        return '', False, -1, -1
+
+    def encode_secrets(self, string_secrets, MODE='text'):
+        # Inputs
+        #   string_secrets: list of N secrets (text, or bit strings for MODE=binary)
+        # Outputs: secret numpy array (N, secret_len), float32
+        if not self.use_ECC:
+            secrets = []
+            for string_secret in string_secrets:
+                if MODE=="binary":
+                    secret = [int(x) for x in string_secret]
+                else:
+                    secret = self.ecc.encode_text_ascii(string_secret)  # bytearray
+                    secret = ''.join(format(x, '08b') for x in secret)
+                    secret = [int(x) for x in secret]
+                secrets.append(np.array(secret, dtype=np.float32))
+            return np.stack(secrets)
         else:
-            assert len(secret_binaryarray.shape)==2
-            secret_pred = ''.join(str(int(x)) for x in secret_binaryarray[0])
-            return secret_pred, True, -1
-         
-    def encode(self, in_cover_image, string_secret, MODE='text', WM_STRENGTH=1.0, WM_MERGE='bilinear'):
+            return self.ecc.encode_payloads(string_secrets, MODE)
+
+    def precompute_secrets(self, string_secrets, MODE='text'):
+        # encodes a whole run of secrets into the DataLayer payload cache ahead of encode()
+        if self.use_ECC:
+            self.ecc.precompute_payloads(string_secrets, MODE)
+
+    def preprocess_for_encode(self, cover_image):
+        # Inputs
+        #   cover_image: PIL image, already cropped by get_the_image_for_processing
+        # Outputs: encoder input tensor (1,3,modelres,modelres) in range [-1, 1]
+        cover = cover_image.resize((self.model_resolution_enc,self.model_resolution_enc), Image.BILINEAR)
+        return self.to_model_input(image_to_tensor(cover).unsqueeze(0)) * 2.0 - 1.0
+
+    @torch.inference_mode()
+    def merge_residual(self, in_cover_image, residual, WM_STRENGTH=1.0, WM_MERGE='bilinear'):
+        # Inputs
+        #   in_cover_image: original PIL image
+        #   residual: (1,3,modelres,modelres) tensor for its processing region
+        # Outputs: stego image (PIL image) at the native size of in_cover_image
+        # The residual is resized and applied in horizontal strips, bounding the working memory
+        width, height = in_cover_image.size
+        region = self.processing_region(width, height)
+        rows = self.strip_rows(width)
+        strips = (np.asarray(in_cover_image.crop((0, y, width, min(y + rows, height)))) for y in range(0, height, rows))
+        out = Image.new('RGB', (width, height))
+        y = 0
+        for strip in merge_strips(strips, residual, region, WM_STRENGTH, WM_MERGE, self.feather_size(region)):
+            out.paste(Image.fromarray(strip), (0, y))
+            y += strip.shape[0]
+        return out
+
+    @torch.inference_mode()
+    def encoder_residual(self, cover, secrets):
+        # Inputs
+        #   cover: encoder input (B,3,modelres,modelres), secrets: (B, secret_len)
+        # Outputs: watermark residual (B,3,modelres,modelres)
+        stego, _ = self.encoder(cover, secrets)
+        residual = stego.clamp(-1, 1) - cover
+
+        residual_mean_c = residual.mean(dim=(2,3), keepdim=True)  # remove color shifts per channel
+        return residual - residual_mean_c
+
+    @torch.inference_mode()
+    def removal_residual(self, stego):
+        # Inputs
+        #   stego: PIL image of the processing region
+        # Outputs: residual (1,3,modelres,modelres) that removes the watermark
+        stego256 = stego.resize((self.model_resolution_remove,self.model_resolution_remove), Image.BILINEAR)
+        stego256 = self.to_model_input(image_to_tensor(stego256).unsqueeze(0)) * 2.0 - 1.0 # (1,3,modelres,modelres) in range [-1, 1]
+        img256 = self.removal(stego256).clamp(-1, 1)
+        return img256 - stego256
+
+    def rendition(self, in_cover_image, long_edge):
+        # cover resized so its long edge is long_edge pixels, None (or anything larger) keeps the native size
+        width, height = in_cover_image.size
+        if long_edge is None or long_edge >= max(width, height):
+            return in_cover_image
+        scale = long_edge / max(width, height)
+        return in_cover_image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+    def encode(self, in_cover_image, string_secret, MODE='text', WM_STRENGTH=1.0, WM_MERGE='bilinear', renditions=None):
         # Inputs
         #   cover_image: PIL image
         #   secret_tensor: (1, secret_len)
-        # Outputs: stego image (PIL image)
-        
-        # secrets
-        if not self.use_ECC:
-            if MODE=="binary":
-                secret = [int(x) for x in string_secret]
-                secret = np.array(secret, dtype=np.float32)
-            else:
-                secret = self.ecc.encode_text_ascii(string_secret)  # bytearray
-                secret = ''.join(format(x, '08b') for x in secret)
-                secret = [int(x) for x in secret]
-                secret = np.array(secret, dtype=np.float32)
-        else:
-            if MODE=="binary":
-                secret = self.ecc.encode_binary([string_secret])
-            else:
-                secret = self.ecc.encode_text([string_secret])
+        #   renditions: optional list of output long edges in pixels, None for the native size
+        # Outputs: stego image (PIL image), or a list of them, one per rendition
+        return self.encode_batch([in_cover_image], [string_secret], MODE=MODE, WM_STRENGTH=WM_STRENGTH, WM_MERGE=WM_MERGE, renditions=renditions)[0]
+
+    def encode_batch(self, in_cover_images, string_secrets, MODE='text', WM_STRENGTH=1.0, WM_MERGE='bilinear', batch_size=ENCODE_BATCH_SIZE, renditions=None):
+        # Inputs
+        #   in_cover_images: list of N PIL images
+        #   string_secrets: list of N secrets, one per image
+        #   renditions: optional list of output long edges in pixels, None for the native size;
+        #     all renditions of an image share its single encoder pass, each gets its own merge
+        # Outputs: list of N stego images (PIL images), each at its native size,
+        #   or with renditions, N lists of stego images in the order of renditions
+        assert len(in_cover_images)==len(string_secrets)
+        secrets = torch.from_numpy(self.encode_secrets(string_secrets, MODE)).float().to(self.device)  # (N, secret_len)
         if self.model_type == 'P':
             WM_STRENGTH = WM_STRENGTH * 1.25
-        secret = torch.from_numpy(secret).float().to(self.device)
-        
-        cover_image = self.get_the_image_for_processing(in_cover_image)
-        w, h = cover_image.size
-        cover = cover_image.resize((self.model_resolution_enc,self.model_resolution_enc), Image.BILINEAR)
-        tic=time.time()
-        cover = transforms.ToTensor()(cover).unsqueeze(0).to(self.encoder.device) * 2.0 - 1.0 # (1,3,modelres,modelres) in range [-1, 1]
-        with torch.no_grad():
-            stego, _ = self.encoder(cover, secret)
-            residual = stego.clamp(-1, 1) - cover
 
-            residual_mean_c = residual.mean(dim=(2,3), keepdim=True)  # remove color shifts per channel
-            residual = residual - residual_mean_c
+        stegos = []
+        for start in range(0, len(in_cover_images), batch_size):
+            in_covers = in_cover_images[start:start+batch_size]
+            cover = torch.cat([self.preprocess_for_encode(self.get_the_image_for_processing(im)) for im in in_covers], dim=0)  # (B,3,modelres,modelres)
+            residual = self.encoder_residual(cover, secrets[start:start+batch_size])
 
-            residual = torch.nn.functional.interpolate(residual, size=(h, w), mode=WM_MERGE)
-            residual = residual.permute(0,2,3,1).cpu().numpy().astype('f4')  # (1,modelres,modelres,3)
-            stego = np.clip(residual[0]*WM_STRENGTH + np.array(cover_image)/127.5-1., -1, 1)*127.5+127.5  # (modelres, modelres, 3), ndarray, uint8
-            stego = self.put_the_image_after_processing(stego, np.asarray(in_cover_image).astype(np.uint8))
+            for i, in_cover_image in enumerate(in_covers):
+                if renditions is None:
+                    stegos.append(self.merge_residual(in_cover_image, residual[i:i+1], WM_STRENGTH, WM_MERGE))
+                else:
+                    stegos.append([self.merge_residual(self.rendition(in_cover_image, long_edge), residual[i:i+1], WM_STRENGTH, WM_MERGE)
+                                   for long_edge in renditions])
 
-        return Image.fromarray(stego.astype(np.uint8))
+        return stegos
+
+    def encode_file(self, in_path, out_path, string_secret, MODE='text', WM_STRENGTH=1.0, WM_MERGE='bilinear'):
+        """ Watermarks the image at in_path into out_path without holding either in memory
+
+        Both files are processed in horizontal strips: .npy and uncompressed TIFF (tifffile) are
+        memory mapped, PNG is streamed row by row (pypng); other formats are loaded whole.
+        The encoder input is downsampled strip by strip with the same fixed point bilinear
+        filter as PIL's resize in encode(), so the output matches encode() pixel for pixel.
+        """
+        width, height, strips = open_strips(in_path)
+        region = self.processing_region(width, height)
+        rows = self.strip_rows(width)
+        if self.model_type == 'P':
+            WM_STRENGTH = WM_STRENGTH * 1.25
+        cover = self.preprocess_for_encode(reduce_strips(strips(rows), region, self.model_resolution_enc))
+        secret = torch.from_numpy(self.encode_secrets([string_secret], MODE)).float().to(self.device)
+        residual = self.encoder_residual(cover, secret)
+        write_strips(out_path, width, height, merge_strips(strips(rows), residual, region, WM_STRENGTH, WM_MERGE, self.feather_size(region)))
 
-    @torch.no_grad()
     def remove_watermark(self, in_cover_image, WM_STRENGTH=1.0, WM_MERGE='bilinear'):
         """Remove watermark from stego image"""
-        stego = self.get_the_image_for_processing(in_cover_image)
-        W, H = stego.size
         if self.model_type == 'P':
             WM_STRENGTH = WM_STRENGTH * 1.25
-        stego256 = stego.resize((self.model_resolution_remove,self.model_resolution_remove), Image.BILINEAR)
-        stego256 = transforms.ToTensor()(stego256).unsqueeze(0).to(self.removal.device) * 2.0 - 1.0 # (1,3,modelres,modelres) in range [-1, 1]
-        img256 = self.removal(stego256).clamp(-1, 1)
-        res = img256 - stego256
-        res = torch.nn.functional.interpolate(res, (H,W), mode=WM_MERGE).permute(0,2,3,1).cpu().numpy()   # (B,3,H,W) no need antialias since this op is mostly upsampling
-        out = np.clip(res[0]*WM_STRENGTH + np.asarray(stego)/127.5-1., -1, 1)*127.5+127.5  # (modelres, modelres, 3), ndarray, uint8
-        stego = self.put_the_image_after_processing(out, np.asarray(in_cover_image).astype(np.uint8))
-        return Image.fromarray(stego.astype(np.uint8))
+        residual = self.removal_residual(self.get_the_image_for_processing(in_cover_image))
+        return self.merge_residual(in_cover_image, residual, WM_STRENGTH, WM_MERGE)
+
+    def remove_watermark_file(self, in_path, out_path, WM_STRENGTH=1.0, WM_MERGE='bilinear'):
+        """ Removes the watermark from the image at in_path into out_path, strip by strip as encode_file """
+        width, height, strips = open_strips(in_path)
+        region = self.processing_region(width, height)
+        rows = self.strip_rows(width)
+        if self.model_type == 'P':
+            WM_STRENGTH = WM_STRENGTH * 1.25
+        residual = self.removal_residual(reduce_strips(strips(rows), region, self.model_resolution_remove))
+        write_strips(out_path, width, height, merge_strips(strips(rows), residual, region, WM_STRENGTH, WM_MERGE, self.feather_size(region)))
+
+
+
+def model_file_stamp(filename, digest):
+    st = os.stat(filename)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino, 'md5': digest}
+
+def checkpoint_digest(filename, reverify=False):
+    """ MD5 of a model file, or of the file it would be downloaded as when it is missing
+
+    Known checkpoints go through verify_model_file, so the digest comes from (or is recorded
+    in) their .verified stamp; only files without a published checksum are hashed every time.
+    """
+    name = pathlib.Path(filename).name
+    if not (os.path.isfile(filename) and os.path.getsize(filename)>0):
+        return MODEL_CHECKSUMS.get(name)
+    if name in MODEL_CHECKSUMS and verify_model_file(filename, reverify=reverify):
+        return MODEL_CHECKSUMS[name]
+    with open(filename, 'rb') as file, mmap(file.fileno(), 0, access=ACCESS_READ) as file:
+        return md5(file).hexdigest()
+
+def verify_model_file(filename, reverify=False):
+    """ Checks a model file against MODEL_CHECKSUMS
+
+    A full MD5 is only computed when the file has no matching sidecar stamp (size, mtime,
+    inode and digest recorded by the last successful check), or when reverify is set.
+    """
+    if not (os.path.isfile(filename) and os.path.getsize(filename)>0):
+        return False
+    digest = MODEL_CHECKSUMS[pathlib.Path(filename).name]
+    stamp_path = filename + VERIFIED_STAMP_SUFFIX
+    stamp = model_file_stamp(filename, digest)
+
+    if not reverify:
+        if VERIFIED_FILES.get(filename) == stamp:
+            return True
+        try:
+            with open(stamp_path) as f:
+                if json.load(f) == stamp:
+                    VERIFIED_FILES[filename] = stamp
+                    return True
+        except (OSError, ValueError):
+            pass
+
+    with open(filename, 'rb') as file, mmap(file.fileno(), 0, access=ACCESS_READ) as file:
+        valid = (digest==md5(file).hexdigest())
+
+    if valid:
+        VERIFIED_FILES[filename] = stamp
+        try:
+            with open(stamp_path, 'w') as f:
+                json.dump(stamp, f)
+        except OSError:
+            pass  # read-only model directory, we just rehash next time
+    else:
+        VERIFIED_FILES.pop(filename, None)
+        if os.path.exists(stamp_path):
+            try:
+                os.remove(stamp_path)
+            except OSError:
+                pass
+    return valid
+
+
+SHARED_INSTANCES = dict()
+SHARED_INSTANCES_LOCK = threading.Lock()
+
+def get_shared_trustmark(model_type='Q', encoding_type=TrustMark.Encoding.BCH_5, device='', components=MODEL_COMPONENTS, verbose=True, **kw_args):
+    """ Returns the process-wide TrustMark instance for these settings, creating it on first use
+
+    Instances are keyed by (model_type, encoding_type, device, components) plus any other
+    TrustMark keyword arguments, so every caller asking for the same settings shares one
+    copy of the model weights.
+    """
+    if not device:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    components = tuple(sorted(components))
+    key = (model_type, encoding_type, device, components, tuple(sorted(kw_args.items())))
+    with SHARED_INSTANCES_LOCK:
+        tm = SHARED_INSTANCES.get(key)
+        if tm is None:
+            tm = TrustMark(verbose=verbose, device=device, model_type=model_type, encoding_type=encoding_type, components=components, **kw_args)
+            SHARED_INSTANCES[key] = tm
+    return tm
+
+
+def cpu_thread_budget(workers=1):
+    # cores available to this process, split evenly between the worker processes sharing the host
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS / Windows
+        cores = os.cpu_count() or 1
+    return max(1, cores // max(1, workers))
+
+def configure_cpu_threads(threads, interop_threads=1):
+    # torch thread pools are process-wide, the last TrustMark configured wins
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        pass  # can only be set once, before any inter-op parallel work has started
+
+
+def bit_error_probabilities(logits, temperature=CONFIDENCE_TEMPERATURE):
+    # chance that each thresholded bit is wrong, reading the decoder logits as log odds
+    return 1.0 / (1.0 + np.exp(np.abs(logits.astype(np.float64)) / temperature))
+
+
+def load_confidence_temperature(path):
+    # temperature fitted by scripts/calibrate_confidence.py, CONFIDENCE_TEMPERATURE when the model has not been calibrated
+    try:
+        with open(path) as f:
+            return float(json.load(f)['temperature'])
+    except (OSError, ValueError, KeyError):
+        return CONFIDENCE_TEMPERATURE
+
+
+def fit_confidence_temperature(logits, bits):
+    """ Temperature making the decoder logits calibrated log odds of their bits being read right
+
+    logits are decoder outputs (N, L) of held-out images whose true bits (N, L) are known; the
+    temperature minimizes the negative log likelihood of every thresholded bit being right or
+    wrong under bit_error_probabilities. The likelihood is convex in 1/temperature, so a
+    golden section search over log(temperature) finds it.
+    """
+    margins = np.abs(np.asarray(logits, dtype=np.float64)).ravel()
+    sign = np.where((np.asarray(logits) > 0).ravel() == (np.asarray(bits) > 0.5).ravel(), 1.0, -1.0)
+
+    def nll(log_temperature):
+        return float(np.logaddexp(0, -sign * margins / np.exp(log_temperature)).sum())
+    lo, hi = np.log(1e-2), np.log(1e2)
+    ratio = (np.sqrt(5) - 1) / 2
+    for _ in range(100):
+        a, b = hi - ratio * (hi - lo), lo + ratio * (hi - lo)
+        if nll(a) < nll(b):
+            hi = b
+        else:
+            lo = a
+    return float(np.exp((lo + hi) / 2))
+
 
+def within_correctable(error_probs, correctable):
+    # probability that at most correctable of the independent bits with these error probabilities are wrong
+    dist = np.zeros(correctable + 1)  # dist[k]: probability of exactly k errors so far
+    dist[0] = 1.0
+    for p in error_probs:
+        dist[1:] = dist[1:] * (1.0 - p) + dist[:-1] * p
+        dist[0] *= 1.0 - p
+    return float(dist.sum())
 
 
+def image_to_tensor(image):
+    # PIL RGB image -> float tensor (3,H,W) in range [0, 1], same result as torchvision ToTensor
+    return torch.from_numpy(np.array(image, dtype=np.uint8)).permute(2, 0, 1).contiguous().float().div(255)
+
 def get_obj_from_str(string, reload=False):
     module, cls = string.rsplit(".", 1)
     if reload:
@@ -445,14 +991,14 @@ def get_obj_from_str(string, reload=False):
 
 
 
-def instantiate_from_config(config):
+def instantiate_from_config(config, targets=None):
     if not "target" in config:
         if config == '__is_first_stage__':
             return None   
         elif config == "__is_unconditional__":
             return None
         raise KeyError("Expected key `target` to instantiate.")
-    return get_obj_from_str(config["target"])(**config.get("params", dict()))
-  
-
-
+    target = config["target"]
+    if targets:
+        target = targets.get(target, target)
+    return get_obj_from_str(target)(**config.get("params", dict()))
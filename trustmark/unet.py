@@ -9,7 +9,6 @@ from torch import nn
 from torch.autograd import Variable
 import torch
 import torch.nn.functional as thf
-import torchvision
 
 
 class Conv2dBlock(nn.Module):
@@ -382,6 +381,7 @@ class MSResNet(nn.Module):
 class SecretDecoder(nn.Module):
     def __init__(self, arch='resnet18', resolution=224, secret_len=100):
         super().__init__()
+        import torchvision  # only needed to build the backbone, keeps `import trustmark` light
         self.resolution = resolution
         self.arch = arch
         if arch == 'resnet18':
@@ -425,3 +425,58 @@ class SecretDecoder(nn.Module):
             image = thf.interpolate(image, size=(self.resolution, self.resolution), mode='bilinear', align_corners=False)
         x = self.decoder(image)
         return x
+
+
+class SimpleUnet(nn.Module):
+    def __init__(self, dim=32) -> None:
+        super().__init__()
+        self.conv1 = nn.Conv2d(3, dim, 3, 1, 1)
+        self.conv2 = nn.Conv2d(dim, dim, 3, 2, 1)
+        self.conv3 = nn.Conv2d(dim, dim*2, 3, 2, 1)
+        self.conv4 = nn.Conv2d(dim*2, dim*4, 3, 2, 1)
+        self.conv5 = nn.Conv2d(dim*4, dim*8, 3, 2, 1)
+        self.pad6 = nn.ZeroPad2d((0, 1, 0, 1))
+        self.up6 = nn.Conv2d(dim*8, dim*4, 2, 1)
+        self.upsample6 = nn.Upsample(scale_factor=(2, 2))
+        self.conv6 = nn.Conv2d(dim*4 + dim*4, dim*4, 3, 1, 1)
+        self.pad7 = nn.ZeroPad2d((0, 1, 0, 1))
+        self.up7 = nn.Conv2d(dim*4, dim*2, 2, 1)
+        self.upsample7 = nn.Upsample(scale_factor=(2, 2))
+        self.conv7 = nn.Conv2d(dim*2 + dim*2, dim*2, 3, 1, 1)
+        self.pad8 = nn.ZeroPad2d((0, 1, 0, 1))
+        self.up8 = nn.Conv2d(dim*2, dim, 2, 1)
+        self.upsample8 = nn.Upsample(scale_factor=(2, 2))
+        self.conv8 = nn.Conv2d(dim+dim, dim, 3, 1, 1)
+        self.pad9 = nn.ZeroPad2d((0, 1, 0, 1))
+        self.up9 = nn.Conv2d(dim, dim, 2, 1)
+        self.upsample9 = nn.Upsample(scale_factor=(2, 2))
+        self.conv9 = nn.Conv2d(dim + dim + 3, dim, 3, 1, 1)
+        self.conv10 = nn.Conv2d(dim, dim, 3, 1, 1)
+        self.post = nn.Conv2d(dim, dim//2, 1)
+        self.silu = nn.SiLU()
+        self.out = nn.Conv2d(dim//2, 3, 1)
+    
+    def forward(self, image):
+        inputs = image
+
+        conv1 = thf.relu(self.conv1(inputs))
+        conv2 = thf.relu(self.conv2(conv1))
+        conv3 = thf.relu(self.conv3(conv2))
+        conv4 = thf.relu(self.conv4(conv3))
+        conv5 = thf.relu(self.conv5(conv4))
+        up6 = thf.relu(self.up6(self.pad6(self.upsample6(conv5))))
+        merge6 = torch.cat([conv4, up6], dim=1)
+        conv6 = thf.relu(self.conv6(merge6))
+        up7 = thf.relu(self.up7(self.pad7(self.upsample7(conv6))))
+        merge7 = torch.cat([conv3, up7], dim=1)
+        conv7 = thf.relu(self.conv7(merge7))
+        up8 = thf.relu(self.up8(self.pad8(self.upsample8(conv7))))
+        merge8 = torch.cat([conv2, up8], dim=1)
+        conv8 = thf.relu(self.conv8(merge8))
+        up9 = thf.relu(self.up9(self.pad9(self.upsample9(conv8))))
+        merge9 = torch.cat([conv1, up9, inputs], dim=1)
+        conv9 = thf.relu(self.conv9(merge9))
+        conv10 = thf.relu(self.conv10(conv9))
+        post = self.silu(self.post(conv10))
+        out = thf.tanh(self.out(post))
+        return out
@@ -40,22 +40,22 @@ print("🚀 Starting YYS-SQR Enhanced Server v2.1...")
 detector = None
 tm = None
 
-try:
-    print("📦 Loading auto corner detection...")
-    from auto_corner_detection import AutoCornerDetector
-    detector = AutoCornerDetector()
-    print("✅ AutoCornerDetector loaded successfully")
-except Exception as e:
-    print(f"❌ AutoCornerDetector failed: {e}")
-
 try:
     print("📦 Loading TrustMark...")
     import trustmark
-    tm = trustmark.TrustMark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER)
+    tm = trustmark.get_shared_trustmark(verbose=False, encoding_type=trustmark.TrustMark.Encoding.BCH_SUPER, components=('encoder', 'decoder'))
     print("✅ TrustMark loaded successfully")
 except Exception as e:
     print(f"❌ TrustMark failed: {e}")
 
+try:
+    print("📦 Loading auto corner detection...")
+    from auto_corner_detection import AutoCornerDetector
+    detector = AutoCornerDetector(tm)
+    print("✅ AutoCornerDetector loaded successfully")
+except Exception as e:
+    print(f"❌ AutoCornerDetector failed: {e}")
+
 app = Flask(
     __name__,
     static_folder='webapp-frontend/build',  # Serve React build
@@ -471,7 +471,6 @@ def api_scan_manual():
             # Load image with OpenCV
             import cv2
             import numpy as np
-            from PIL import Image as PILImage
             
             image = cv2.imread(temp_path)
             if image is None:
@@ -493,12 +492,8 @@ def api_scan_manual():
             matrix = cv2.getPerspectiveTransform(coordinates, destination_points)
             corrected_image_cv = cv2.warpPerspective(image, matrix, (output_width, output_height))
             
-            # Convert to RGB for TrustMark
-            corrected_image_rgb = cv2.cvtColor(corrected_image_cv, cv2.COLOR_BGR2RGB)
-            image_to_decode = PILImage.fromarray(corrected_image_rgb)
-            
-            # Decode watermark
-            secret_id, present, _ = tm.decode(image_to_decode)
+            # Decode watermark, TrustMark takes the BGR array as it is
+            secret_id, present, _ = tm.decode(corrected_image_cv)
             
             if present:
                 # Look up card in database